@@ -0,0 +1,115 @@
+# bench_simplify.py
+#
+# パスの間引きを、1 本ずつ shapely（LineString.simplify）を呼ぶ以前の処理と simplify.py で比較する。
+# ストロークの長さごとに、1 本ずつ処理した場合とまとめて処理した場合の時間を出す。
+# 次の場合は終了コード 1 で終わる（以前の処理より 10% 以上遅い）。
+#   numpy batch : NumPy 実装でまとめて間引く。アプリが NumPy に任せる長さ（ACCELERATE_MIN_POINTS 未満）で比べる
+#   dp batch    : アプリが全パスを間引き直す時の経路（長いパスは shapely があれば GEOS）。全ての長さで比べる
+#
+#   python benchmarks/bench_simplify.py [--paths 200] [--tolerance 2] [--lengths 20 30 200 1000 5000]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simplify import ACCELERATE_MIN_POINTS, douglas_peucker, simplify_batch, visvalingam_whyatt
+
+try:
+    from shapely.geometry import LineString
+except ImportError:
+    LineString = None
+
+SLOWER_MARGIN = 1.1
+
+
+def make_strokes(count, length, seed=0):
+    # マウス入力に近い、整数座標の滑らかなランダムウォーク
+    rng = np.random.default_rng(seed)
+    strokes = []
+    for _ in range(count):
+        heading = np.cumsum(rng.normal(0, 0.15, length))
+        steps = np.column_stack((np.cos(heading), np.sin(heading))) * rng.uniform(1, 4, (length, 1))
+        strokes.append(np.round(np.cumsum(steps, axis=0) + rng.uniform(0, 2000, 2)))
+    return strokes
+
+
+def run_shapely(strokes, tolerance):
+    return [np.array(LineString(points).simplify(tolerance, preserve_topology=False).coords) for points in strokes]
+
+
+def timed(funcs, repeat):
+    # 比べる処理を交互に繰り返し、それぞれの最短時間と結果を返す（負荷の揺れが片方に偏らないように）
+    best = [float('inf')] * len(funcs)
+    results = [None] * len(funcs)
+    for _ in range(repeat):
+        for k, func in enumerate(funcs):
+            start = time.perf_counter()
+            results[k] = func()
+            best[k] = min(best[k], time.perf_counter() - start)
+    return list(zip(best, results))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--paths', type=int, default=200)
+    parser.add_argument('--tolerance', type=float, default=2.0)
+    parser.add_argument('--lengths', type=int, nargs='+', default=[20, 30, 200, 1000, 5000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if LineString is None:
+        print("shapely is not installed; only simplify.py is timed and nothing is compared.")
+
+    print(f"{args.paths} paths per length, tolerance {args.tolerance}, best of {args.repeat}")
+    print(f"{'points':>7s} {'shapely':>11s} {'dp':>11s} {'dp batch':>11s} {'numpy batch':>11s} "
+          f"{'vw':>11s} {'vw batch':>11s}  kept")
+    slower = []
+    for length in args.lengths:
+        strokes = make_strokes(args.paths, length)
+        funcs = [lambda: [douglas_peucker(points, args.tolerance) for points in strokes],
+                 lambda: simplify_batch(strokes, args.tolerance),
+                 lambda: simplify_batch(strokes, args.tolerance, backend='numpy')]
+        if LineString is not None:
+            funcs.insert(0, lambda: run_shapely(strokes, args.tolerance))
+        measured = timed(funcs, args.repeat)
+        if LineString is None:
+            measured.insert(0, (None, None))
+        (reference_time, reference), (single_time, single), (batch_time, batch), (numpy_time, numpy_batch) = measured
+        row = [reference_time, single_time, batch_time, numpy_time]
+        # Visvalingam–Whyatt は面積の閾値なので、距離の許容値の 2 乗を目安に与える
+        (vw_time, _), (vw_batch_time, _) = timed(
+            [lambda: [visvalingam_whyatt(points, args.tolerance ** 2) for points in strokes],
+             lambda: simplify_batch(strokes, args.tolerance ** 2, method='visvalingam_whyatt')], args.repeat)
+        row += [vw_time, vw_batch_time]
+
+        if reference is not None:
+            assert all(np.array_equal(a, b) for a, b in zip(reference, single)), 'dp differs from shapely'
+            assert all(np.array_equal(a, b) for a, b in zip(reference, numpy_batch)), 'numpy batch differs from shapely'
+            # 計測の揺れとして 10% までは許す
+            gated = [('dp batch', batch_time)]
+            if length < ACCELERATE_MIN_POINTS:
+                gated.append(('numpy batch', numpy_time))
+            for name, elapsed in gated:
+                if elapsed > reference_time * SLOWER_MARGIN:
+                    slower.append(f"{name} at {length} points: {elapsed * 1000:.1f} ms "
+                                  f"vs shapely {reference_time * 1000:.1f} ms")
+        assert all(np.array_equal(a, b) for a, b in zip(single, batch)), 'batch differs from dp'
+        assert all(np.array_equal(a, b) for a, b in zip(batch, numpy_batch)), 'numpy batch differs from dp batch'
+        kept = sum(len(points) for points in batch) / (args.paths * length)
+        cells = ' '.join(f"{elapsed * 1000:8.1f} ms" if elapsed is not None else f"{'-':>11s}" for elapsed in row)
+        print(f"{length:7d} {cells}  {kept:.0%}")
+
+    if slower:
+        print("Slower than shapely:")
+        for line in slower:
+            print(f"  {line}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# bench_stroke_renderer.py
+#
+# 1サンプルごとに QPainter を開く従来方式と、フレーム単位でまとめて描く
+# StrokeRenderer 方式の入力イベント処理スループットを比較する。
+#
+#   python benchmarks/bench_stroke_renderer.py [--events 20000] [--rate 500]
+
+import argparse
+import math
+import os
+import sys
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QPixmap, QPainter, QPen, QColor
+from PyQt5.QtCore import Qt, QPoint
+from stroke_renderer import StrokeRenderer
+
+
+def make_samples(count, width, height):
+    samples = []
+    for i in range(count):
+        t = i / 50.0
+        x = width / 2 + math.cos(t) * width * 0.4 * math.sin(t * 0.13)
+        y = height / 2 + math.sin(t * 1.7) * height * 0.4
+        pressure = 0.5 + 0.5 * math.sin(t * 0.05)
+        samples.append((QPoint(int(x), int(y)), max(1, 8 * pressure)))
+    return samples
+
+
+def run_per_event(layer, samples):
+    color = QColor(Qt.black)
+    start = time.perf_counter()
+    last = samples[0][0]
+    for point, pen_size in samples[1:]:
+        painter = QPainter(layer)
+        painter.setPen(QPen(color, pen_size, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
+        painter.drawLine(last, point)
+        painter.end()
+        last = point
+    return time.perf_counter() - start
+
+
+def run_coalesced(layer, samples, events_per_frame, constant_width):
+    color = QColor(Qt.black)
+    state = {'last': samples[0][0]}
+
+    def flush(batch, brush):
+        painter = QPainter(layer)
+        state['last'] = StrokeRenderer.draw_samples(painter, brush, state['last'], batch)
+        painter.end()
+
+    renderer = StrokeRenderer(flush, interval_ms=1000)
+    start = time.perf_counter()
+    for index, (point, pen_size) in enumerate(samples[1:], 1):
+        if constant_width:
+            pen_size = 5
+        renderer.add_sample(point, pen_size, color)
+        # タイマーの代わりにフレーム境界で明示的に flush する
+        if index % events_per_frame == 0:
+            renderer.flush()
+    renderer.flush()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--rate', type=int, default=500, help='input events per second (tablet report rate)')
+    parser.add_argument('--fps', type=int, default=60)
+    parser.add_argument('--width', type=int, default=3840)
+    parser.add_argument('--height', type=int, default=2160)
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    samples = make_samples(args.events, args.width, args.height)
+    events_per_frame = max(1, args.rate // args.fps)
+
+    results = []
+    for name, runner in [
+        ('per-event painter', lambda layer: run_per_event(layer, samples)),
+        ('coalesced (pressure)', lambda layer: run_coalesced(layer, samples, events_per_frame, False)),
+        ('coalesced (mouse)', lambda layer: run_coalesced(layer, samples, events_per_frame, True)),
+    ]:
+        layer = QPixmap(args.width, args.height)
+        layer.fill(Qt.transparent)
+        elapsed = runner(layer)
+        results.append((name, elapsed))
+
+    print(f"{args.events} events, {events_per_frame} events/frame, canvas {args.width}x{args.height}")
+    baseline = results[0][1]
+    for name, elapsed in results:
+        print(f"{name:22s} {elapsed * 1000:9.1f} ms  {args.events / elapsed:12.0f} events/s  x{baseline / elapsed:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+# bezier_fit.py
+#
+# 折れ線を誤差 tolerance 以内の 3 次ベジェ曲線列に当てはめる
+# （Schneider, "An Algorithm for Automatically Fitting Digitized Curves", Graphics Gems, 1990）。
+# 戻り値は (M, 4, 2) の配列で、各行が [始点, 制御点1, 制御点2, 終点]。
+
+import numpy as np
+
+MAX_REPARAMETERIZE = 20
+
+
+def bezier_points(bezier, u):
+    u = u[:, None]
+    v = 1 - u
+    return (v ** 3 * bezier[0] + 3 * v ** 2 * u * bezier[1] +
+            3 * v * u ** 2 * bezier[2] + u ** 3 * bezier[3])
+
+
+def bezier_first_derivative(bezier, u):
+    u = u[:, None]
+    v = 1 - u
+    return (3 * v ** 2 * (bezier[1] - bezier[0]) + 6 * v * u * (bezier[2] - bezier[1]) +
+            3 * u ** 2 * (bezier[3] - bezier[2]))
+
+
+def bezier_second_derivative(bezier, u):
+    u = u[:, None]
+    return 6 * (1 - u) * (bezier[2] - 2 * bezier[1] + bezier[0]) + 6 * u * (bezier[3] - 2 * bezier[2] + bezier[1])
+
+
+def normalize(vector):
+    length = np.hypot(*vector)
+    return vector / length if length > 0 else vector
+
+
+def chord_length_parameters(points):
+    lengths = np.concatenate(([0.0], np.cumsum(np.hypot(*np.diff(points, axis=0).T))))
+    return lengths / lengths[-1] if lengths[-1] > 0 else np.linspace(0, 1, len(points))
+
+
+def generate_bezier(points, u, left_tangent, right_tangent):
+    # 端点と接線方向を固定し、接線の長さだけを最小二乗で決める
+    start, end = points[0], points[-1]
+    v = 1 - u
+    b0, b1, b2, b3 = v ** 3, 3 * v ** 2 * u, 3 * v * u ** 2, u ** 3
+    a1 = b1[:, None] * left_tangent
+    a2 = b2[:, None] * right_tangent
+    c00 = np.einsum('ij,ij->', a1, a1)
+    c01 = np.einsum('ij,ij->', a1, a2)
+    c11 = np.einsum('ij,ij->', a2, a2)
+    residual = points - ((b0 + b1)[:, None] * start + (b2 + b3)[:, None] * end)
+    x0 = np.einsum('ij,ij->', a1, residual)
+    x1 = np.einsum('ij,ij->', a2, residual)
+
+    det = c00 * c11 - c01 * c01
+    alpha_left = (x0 * c11 - x1 * c01) / det if det != 0 else 0.0
+    alpha_right = (c00 * x1 - c01 * x0) / det if det != 0 else 0.0
+    segment_length = np.hypot(*(end - start))
+    epsilon = 1e-6 * segment_length
+    if alpha_left < epsilon or alpha_right < epsilon:
+        # 最小二乗が破綻した時は弦長の 1/3 を使う
+        alpha_left = alpha_right = segment_length / 3
+    return np.array((start, start + left_tangent * alpha_left, end + right_tangent * alpha_right, end))
+
+
+def reparameterize(bezier, points, u):
+    # Newton 法で各点に最も近い曲線上のパラメータへ寄せる
+    difference = bezier_points(bezier, u) - points
+    first = bezier_first_derivative(bezier, u)
+    second = bezier_second_derivative(bezier, u)
+    numerator = np.einsum('ij,ij->i', difference, first)
+    denominator = np.einsum('ij,ij->i', first, first) + np.einsum('ij,ij->i', difference, second)
+    step = np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator != 0)
+    return np.clip(u - step, 0, 1)
+
+
+def max_error(bezier, points, u):
+    difference = bezier_points(bezier, u) - points
+    errors = np.einsum('ij,ij->i', difference, difference)
+    split = int(np.argmax(errors))
+    if split == 0 or split == len(points) - 1:
+        split = len(points) // 2
+    return errors.max(), split
+
+
+def fit_cubic(points, left_tangent, right_tangent, tolerance, segments):
+    if len(points) == 2:
+        distance = np.hypot(*(points[1] - points[0])) / 3
+        segments.append(np.array((points[0], points[0] + left_tangent * distance,
+                                  points[1] + right_tangent * distance, points[1])))
+        return
+
+    u = chord_length_parameters(points)
+    bezier = generate_bezier(points, u, left_tangent, right_tangent)
+    # 誤差は距離の 2 乗で比べる
+    error, split = max_error(bezier, points, u)
+    if error <= tolerance ** 2:
+        segments.append(bezier)
+        return
+
+    if error <= (2 * tolerance) ** 2:
+        for _ in range(MAX_REPARAMETERIZE):
+            u = reparameterize(bezier, points, u)
+            bezier = generate_bezier(points, u, left_tangent, right_tangent)
+            error, split = max_error(bezier, points, u)
+            if error <= tolerance ** 2:
+                segments.append(bezier)
+                return
+
+    center_tangent = normalize(points[split - 1] - points[split + 1])
+    if not center_tangent.any():
+        center_tangent = normalize(points[split - 1] - points[split])
+    fit_cubic(points[:split + 1], left_tangent, center_tangent, tolerance, segments)
+    fit_cubic(points[split:], -center_tangent, right_tangent, tolerance, segments)
+
+
+def fit_beziers(points, tolerance):
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    # 重複点は接線と弦長パラメータを壊すので取り除く
+    if len(points) > 1:
+        distinct = np.concatenate(([True], np.any(np.diff(points, axis=0) != 0, axis=1)))
+        points = points[distinct]
+    if len(points) < 2:
+        return np.empty((0, 4, 2))
+
+    segments = []
+    left_tangent = normalize(points[1] - points[0])
+    right_tangent = normalize(points[-2] - points[-1])
+    fit_cubic(points, left_tangent, right_tangent, tolerance, segments)
+    return np.array(segments)
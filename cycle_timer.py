@@ -0,0 +1,40 @@
+# cycle_timer.py
+
+import sys
+import time
+
+
+class CycleTimer:
+    # 画像 1 枚あたりの作業時間と、保存から次の画像が表示されるまでの時間を記録する。
+    # --cycle-report 付きで起動すると 1 枚ごとと終了時に表示する
+    def __init__(self):
+        self.enabled = '--cycle-report' in sys.argv
+        self.image_started = None
+        self.save_started = None
+        self.cycles = []
+
+    def save(self, started=None):
+        self.save_started = time.perf_counter() if started is None else started
+
+    def image_shown(self):
+        now = time.perf_counter()
+        # 保存からの画像送りの時だけ 1 サイクルとして数える
+        if self.save_started is not None and self.image_started is not None:
+            cycle = (now - self.image_started, now - self.save_started)
+            self.cycles.append(cycle)
+            if self.enabled:
+                print(f"Image {len(self.cycles)}: cycle {cycle[0]:.2f} s, save to next {cycle[1] * 1000:.1f} ms")
+        self.image_started = now
+        self.save_started = None
+
+    def report(self):
+        if not self.enabled or not self.cycles:
+            return
+        cycles = [cycle for cycle, _ in self.cycles]
+        latencies = [latency for _, latency in self.cycles]
+        print(f"Save cycles: {len(self.cycles)} images")
+        print(f"  cycle        mean {sum(cycles) / len(cycles):8.2f} s   max {max(cycles):8.2f} s")
+        print(f"  save to next mean {sum(latencies) / len(latencies) * 1000:8.1f} ms  max {max(latencies) * 1000:8.1f} ms")
+
+
+cycle_timer = CycleTimer()
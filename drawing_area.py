@@ -2,8 +2,11 @@
 
 from PyQt5.QtWidgets import QWidget, QApplication
 from PyQt5.QtGui import QPixmap, QPainter, QPen, QColor, QCursor, QPainterPath, QImage, QTabletEvent
-from PyQt5.QtCore import Qt, QPoint, QPointF, QSize, QEvent
+from PyQt5.QtCore import Qt, QPoint, QPointF, QSize, QEvent, QRect, QRectF
 from spline_manager import SplineManager
+from raster_undo import RasterDelta
+from undo_history import UndoHistory
+from stroke_renderer import StrokeRenderer
 
 
 class DrawingArea(QWidget):
@@ -19,23 +22,35 @@ class DrawingArea(QWidget):
         self.raster_layer = QPixmap(initial_size)
         self.raster_layer.fill(Qt.transparent)
 
-        self.vector_layer = QPixmap(initial_size)
-        self.vector_layer.fill(Qt.transparent)
+        # ラスターレイヤーに何も描かれていない間は合成を省く
+        self.raster_layer_blank = True
+        # 画像送りで差し替える、透明に塗り済みのレイヤー（prepare_idle_layers で用意する）
+        self.spare_raster_layer = None
 
-        self.current_layer = self.raster_layer
+        # 背景・ラスターレイヤー・非選択パスを合成したキャッシュ
+        self.composite_cache = None
+        self.composite_dirty_rect = QRect()
+
+        # 操作対象外のパスだけを描いたレイヤー。選択中・描画中のパスは毎フレーム上に重ねる
+        self.static_vector_layer = None
+        self.static_vector_layer_dirty = True
 
         self.drawing = False
         self.last_point = QPoint()
         self.pen_size = self.main_window.pen_size
         self.eraser_key_pressed = False
         self.right_button_pressed = False
-        self.undo_stack = []
-        self.redo_stack = []
+        self.history = UndoHistory(self.main_window.undo_memory_budget_mb, self.main_window.undo_disk_budget_mb)
+        self.pending_raster_delta = None
+        self.raster_renderer = StrokeRenderer(self.paint_raster_samples)
+        self.stroke_last_point = None
         self.colors = self.main_window.colors
         self.current_color_index = self.main_window.current_color_index
         self.background_color = self.main_window.background_color
         self.use_tablet = self.main_window.use_tablet
         self.original_pixmap = None
+        # 保存の合成用に、表示中の画像をデコードした QImage のまま持っておく
+        self.original_image = None
         self.current_tablet_device = None
         self.update_cursor()
 
@@ -52,22 +67,41 @@ class DrawingArea(QWidget):
         self.stabilization_degree = degree
         self.point_buffer = []
 
-    def set_image(self, pixmap):
-        self.original_pixmap = pixmap
+    def set_image(self, image):
+        self.original_image = image
+        self.original_pixmap = QPixmap.fromImage(image)
         new_size = self.original_pixmap.size()
-        self.raster_layer = QPixmap(new_size)
-        self.raster_layer.fill(Qt.transparent)
-        self.vector_layer = QPixmap(new_size)
-        self.vector_layer.fill(Qt.transparent)
+        self.raster_layer = self.fresh_raster_layer(new_size)
+        # ベクターレイヤーは必要になった時にこのサイズで描き直される
+        self.update_vector_layer()
         self.setFixedSize(new_size)
         self.update()
         self.main_window.resize(self.main_window.sizeHint())
 
+    def fresh_raster_layer(self, size):
+        # 用意しておいた空のレイヤーと差し替える。今のレイヤーは保存中の書き込みと共有しているので、
+        # その場で塗り直すとコピーが発生する
+        layer = self.spare_raster_layer
+        self.spare_raster_layer = None
+        if layer is None or layer.size() != size:
+            layer = QPixmap(size)
+            layer.fill(Qt.transparent)
+        self.raster_layer_blank = True
+        return layer
+
+    def prepare_idle_layers(self):
+        # 画像を表示した後の空き時間に、次の画像用の空レイヤーと今の画像の合成キャッシュを作っておく
+        size = self.raster_layer.size()
+        if self.spare_raster_layer is None or self.spare_raster_layer.size() != size:
+            self.spare_raster_layer = QPixmap(size)
+            self.spare_raster_layer.fill(Qt.transparent)
+        self.ensure_composite()
+
     def create_default_image(self, size):
         self.raster_layer = QPixmap(size)
         self.raster_layer.fill(Qt.transparent)
-        self.vector_layer = QPixmap(size)
-        self.vector_layer.fill(Qt.transparent)
+        self.raster_layer_blank = True
+        self.update_vector_layer()
         self.setFixedSize(size)
         self.update()
 
@@ -92,8 +126,7 @@ class DrawingArea(QWidget):
                 if pen_tool_button != Qt.NoButton and button == pen_tool_button:
                     self.drawing = True
                     self.last_point = pos
-                    self.push_undo_stack()
-                    self.redo_stack.clear()
+                    self.begin_raster_stroke()
                     self.draw_point(pos)
                     self.update_cursor()
                     self.point_buffer = []
@@ -101,15 +134,15 @@ class DrawingArea(QWidget):
                     self.drawing = True
                     self.last_point = pos
                     self.right_button_pressed = True
-                    self.redo_stack.clear()
+                    self.begin_raster_stroke()
                     self.draw_point(pos)
                     self.update_cursor()
                     self.point_buffer = []
 
     def mouseMoveEvent(self, event):
         if self.mode == 'spline':
+            # 再描画範囲は SplineManager 側で指定する
             self.spline_manager.handle_mouse_move(event)
-            self.update()
             return
         else:
             pos = self.get_image_coordinates(event.pos())
@@ -121,10 +154,10 @@ class DrawingArea(QWidget):
                     avg_x = sum(p.x() for p in self.point_buffer) / len(self.point_buffer)
                     avg_y = sum(p.y() for p in self.point_buffer) / len(self.point_buffer)
                     stabilized_pos = QPoint(int(avg_x), int(avg_y))
-                    self.draw_line(self.last_point, stabilized_pos)
+                    self.draw_line(stabilized_pos)
                     self.last_point = stabilized_pos
                 else:
-                    self.draw_line(self.last_point, pos)
+                    self.draw_line(pos)
                     self.last_point = pos
 
     def mouseReleaseEvent(self, event):
@@ -138,8 +171,10 @@ class DrawingArea(QWidget):
             eraser_tool_button = self.main_window.mouse_config.get("Eraser Tool", Qt.RightButton)
             if button == pen_tool_button:
                 self.drawing = False
+                self.end_raster_stroke()
             elif button == eraser_tool_button:
                 self.drawing = False
+                self.end_raster_stroke()
                 self.right_button_pressed = False
                 self.update_cursor()
 
@@ -162,8 +197,7 @@ class DrawingArea(QWidget):
             if event.type() == QEvent.TabletPress:
                 self.drawing = True
                 self.last_point = img_pos
-                self.push_undo_stack()
-                self.redo_stack.clear()
+                self.begin_raster_stroke()
                 self.draw_point(img_pos, pressure_pen_size)
                 self.update_cursor()
                 self.point_buffer = []
@@ -176,14 +210,15 @@ class DrawingArea(QWidget):
                     avg_x = sum(p.x() for p in self.point_buffer) / len(self.point_buffer)
                     avg_y = sum(p.y() for p in self.point_buffer) / len(self.point_buffer)
                     stabilized_pos = QPoint(int(avg_x), int(avg_y))
-                    self.draw_line(self.last_point, stabilized_pos, pressure_pen_size)
+                    self.draw_line(stabilized_pos, pressure_pen_size)
                     self.last_point = stabilized_pos
                 else:
-                    self.draw_line(self.last_point, img_pos, pressure_pen_size)
+                    self.draw_line(img_pos, pressure_pen_size)
                     self.last_point = img_pos
                 event.accept()
             elif event.type() == QEvent.TabletRelease:
                 self.drawing = False
+                self.end_raster_stroke()
                 event.accept()
             else:
                 event.ignore()
@@ -193,54 +228,142 @@ class DrawingArea(QWidget):
     def draw_point(self, point, pen_size=None):
         if pen_size is None:
             pen_size = self.pen_size
-        painter = QPainter(self.raster_layer)
-        if self.is_eraser_active():
-            painter.setCompositionMode(QPainter.CompositionMode_Clear)
-            pen = QPen(Qt.transparent, pen_size, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin)
-        else:
-            pen = QPen(self.colors[self.current_color_index], pen_size, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin)
-        painter.setPen(pen)
-        painter.drawPoint(point)
-        painter.end()
-        self.update()
+        self.raster_renderer.flush()
+        self.stroke_last_point = None
+        self.raster_renderer.add_sample(point, pen_size, self.current_brush())
 
-    def draw_line(self, start, end, pen_size=None):
+    def draw_line(self, end, pen_size=None):
+        # 直前のサンプルから end まで。実際の描画はフレームごとにまとめて paint_raster_samples で行う
         if pen_size is None:
             pen_size = self.pen_size
-        painter = QPainter(self.raster_layer)
+        self.raster_renderer.add_sample(end, pen_size, self.current_brush())
+
+    def current_brush(self):
+        # 消しゴムなら None、そうでなければペンの色
         if self.is_eraser_active():
+            return None
+        return QColor(self.colors[self.current_color_index])
+
+    def paint_raster_samples(self, samples, brush):
+        dirty_rect = StrokeRenderer.samples_rect(self.stroke_last_point, samples).toAlignedRect()
+        self.record_raster_change(dirty_rect)
+        self.raster_layer_blank = False
+        painter = QPainter(self.raster_layer)
+        if brush is None:
             painter.setCompositionMode(QPainter.CompositionMode_Clear)
-            pen = QPen(Qt.transparent, pen_size, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin)
+            color = Qt.transparent
         else:
-            pen = QPen(self.colors[self.current_color_index], pen_size, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin)
-        painter.setPen(pen)
-        painter.drawLine(start, end)
+            color = brush
+        self.stroke_last_point = StrokeRenderer.draw_samples(painter, color, self.stroke_last_point, samples)
         painter.end()
-        self.update()
-
-    def paintEvent(self, event):
-        painter = QPainter(self)
-        painter.setRenderHint(QPainter.SmoothPixmapTransform)
-
+        self.invalidate_composite(dirty_rect)
+        self.update(self.image_rect_to_widget(dirty_rect))
+
+    def begin_raster_stroke(self):
+        self.end_raster_stroke()
+        self.pending_raster_delta = RasterDelta()
+        self.push_undo_stack(self.pending_raster_delta)
+
+    def record_raster_change(self, rect):
+        if self.pending_raster_delta is not None:
+            self.pending_raster_delta.capture(self.raster_layer, rect)
+
+    def end_raster_stroke(self):
+        self.raster_renderer.flush()
+        if self.pending_raster_delta is not None:
+            self.pending_raster_delta.commit(self.raster_layer)
+            self.pending_raster_delta = None
+            # ストローク確定でエントリのサイズが決まるので予算を再確認する
+            self.history.enforce_budget()
+
+    def image_scale(self):
         widget_size = self.size()
         if self.original_pixmap:
             pixmap_size = self.original_pixmap.size()
         else:
             pixmap_size = self.raster_layer.size()
+        if pixmap_size.isEmpty():
+            return 1.0, 1.0
+        return widget_size.width() / pixmap_size.width(), widget_size.height() / pixmap_size.height()
+
+    def image_rect_to_widget(self, rect):
+        scale_x, scale_y = self.image_scale()
+        return QRectF(rect.x() * scale_x, rect.y() * scale_y,
+                      rect.width() * scale_x, rect.height() * scale_y).toAlignedRect().adjusted(-1, -1, 1, 1)
+
+    def widget_rect_to_image(self, rect):
+        scale_x, scale_y = self.image_scale()
+        return QRectF(rect.x() / scale_x, rect.y() / scale_y,
+                      rect.width() / scale_x, rect.height() / scale_y).toAlignedRect().adjusted(-1, -1, 1, 1)
+
+    def invalidate_composite(self, rect=None):
+        if rect is None:
+            self.composite_dirty_rect = self.raster_layer.rect()
+        else:
+            self.composite_dirty_rect = self.composite_dirty_rect.united(rect)
+
+    def ensure_composite(self):
+        size = self.raster_layer.size()
+        if self.composite_cache is None or self.composite_cache.size() != size:
+            self.composite_cache = QPixmap(size)
+            self.composite_dirty_rect = self.raster_layer.rect()
+        rect = self.composite_dirty_rect.intersected(self.raster_layer.rect())
+        self.composite_dirty_rect = QRect()
+        if rect.isEmpty():
+            return
 
-        scale_x = widget_size.width() / pixmap_size.width()
-        scale_y = widget_size.height() / pixmap_size.height()
+        painter = QPainter(self.composite_cache)
+        painter.setClipRect(rect)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        if self.original_pixmap:
+            painter.drawPixmap(rect, self.original_pixmap, rect)
+        else:
+            painter.fillRect(rect, self.background_color)
+        painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+        # 画像送り直後のように空のレイヤーは重ねない
+        if not self.raster_layer_blank:
+            painter.drawPixmap(rect, self.raster_layer, rect)
+        if self.spline_manager.paths:
+            painter.drawPixmap(rect, self.ensure_static_vector_layer(), rect)
+        painter.end()
 
-        painter.scale(scale_x, scale_y)
+    def ensure_static_vector_layer(self):
+        size = self.raster_layer.size()
+        if self.static_vector_layer is None or self.static_vector_layer.size() != size:
+            self.static_vector_layer = QPixmap(size)
+            self.static_vector_layer_dirty = True
+        if self.static_vector_layer_dirty:
+            self.static_vector_layer.fill(Qt.transparent)
+            painter = QPainter(self.static_vector_layer)
+            self.spline_manager.draw_static_paths(painter)
+            painter.end()
+            self.static_vector_layer_dirty = False
+        return self.static_vector_layer
 
-        if self.original_pixmap:
-            painter.drawPixmap(0, 0, self.original_pixmap)
+    def update_active_paths(self, rect):
+        # ドラッグ中は選択パスの移動前後の範囲だけを再描画する（静的レイヤーは作り直さない）
+        if not rect.isEmpty():
+            self.update(self.image_rect_to_widget(rect.toAlignedRect()))
+
+    def paintEvent(self, event):
+        # 画像送り直後のように背景しかない間は、合成キャッシュを作らずに画像をそのまま描く
+        if self.original_pixmap and self.raster_layer_blank and not self.spline_manager.paths:
+            source = self.original_pixmap
         else:
-            painter.fillRect(self.rect(), self.background_color)
+            self.ensure_composite()
+            source = self.composite_cache
+
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        painter.setClipRect(event.rect())
 
-        painter.drawPixmap(0, 0, self.raster_layer)
+        scale_x, scale_y = self.image_scale()
+        painter.scale(scale_x, scale_y)
 
-        self.spline_manager.draw_paths(painter)
+        # 無効化された領域だけをキャッシュから転送し、選択中・描画中のパスを上に重ねる
+        dirty_rect = self.widget_rect_to_image(event.rect()).intersected(self.raster_layer.rect())
+        painter.drawPixmap(dirty_rect, source, dirty_rect)
+        self.spline_manager.draw_active_paths(painter, QRectF(dirty_rect))
 
         painter.end()
 
@@ -250,11 +373,9 @@ class DrawingArea(QWidget):
         if key == toggle_tool_key:
             if self.mode == 'draw':
                 self.mode = 'spline'
-                self.current_layer = self.vector_layer
                 print("Mode switched to spline")
             else:
                 self.mode = 'draw'
-                self.current_layer = self.raster_layer
                 print("Mode switched to draw")
             return
 
@@ -292,7 +413,7 @@ class DrawingArea(QWidget):
         toggle_fill_key = self.main_window.key_config.get("Toggle Fill", Qt.Key_F)
         if key == toggle_fill_key:
             if self.mode == 'spline' and self.spline_manager.selected_paths:
-                for path in self.spline_manager.selected_paths:
+                for path in self.spline_manager.begin_edit():
                     path.fill_enabled = not path.fill_enabled
                     path.generate_path_from_bspline()
                 self.update_vector_layer()
@@ -352,7 +473,7 @@ class DrawingArea(QWidget):
         self.main_window.current_color_index = self.current_color_index
         self.update_cursor()
         if self.mode == 'spline':
-            for vp in self.spline_manager.selected_paths:
+            for vp in self.spline_manager.detach_selected_paths():
                 vp.pen_color = self.colors[self.current_color_index]
             self.update()
 
@@ -362,89 +483,79 @@ class DrawingArea(QWidget):
 
     def clear_paint_layer(self, push_undo=True):
         if push_undo:
-            self.push_undo_stack()
+            self.push_undo_stack(self.capture_raster_clear())
         self.raster_layer.fill(Qt.transparent)
+        self.raster_layer_blank = True
+        self.invalidate_composite()
         self.update()
 
+    def capture_raster_clear(self):
+        self.end_raster_stroke()
+        delta = RasterDelta()
+        delta.capture(self.raster_layer, self.raster_layer.rect())
+        delta.commit(self.raster_layer, cleared=True)
+        return delta
+
     def clear_vector_layer(self, push_undo=True):
         if push_undo:
             self.push_undo_stack()
-        self.spline_manager.paths.clear()
-        self.spline_manager.selected_paths.clear()
+        self.spline_manager.clear_paths()
         self.update_vector_layer()
         self.update()
 
     def clear_all_layers(self):
-        self.push_undo_stack()
+        self.push_undo_stack(self.capture_raster_clear())
         self.raster_layer.fill(Qt.transparent)
-        self.spline_manager.paths.clear()
-        self.spline_manager.selected_paths.clear()
+        self.raster_layer_blank = True
+        self.invalidate_composite()
+        self.spline_manager.clear_paths()
         self.update_vector_layer()
         self.update()
 
-    def save_state(self):
-        state = {
-            'raster_layer': self.raster_layer.copy(),
-            'vector_layer': self.vector_layer.copy(),
-            'spline_manager': self.spline_manager.copy()
-        }
-        self.undo_stack.append(state)
-        if len(self.undo_stack) > 300:
-            self.undo_stack.pop(0)
-        self.redo_stack.clear()
-
-    def push_undo_stack(self):
-        spline_manager_copy = self.spline_manager.copy()
-        self.undo_stack.append({
-            'raster_layer': self.raster_layer.copy(),
-            'spline_manager': spline_manager_copy
+    def push_undo_stack(self, raster_delta=None):
+        self.history.push({
+            'raster': raster_delta,
+            'paths': self.spline_manager.snapshot()
         })
-        if len(self.undo_stack) > 300:
-            self.undo_stack.pop(0)
-        self.redo_stack.clear()
+
+    def clear_history(self):
+        self.raster_renderer.discard()
+        self.pending_raster_delta = None
+        self.history.clear()
+
+    def swap_path_document(self, state):
+        # 現在のパス一覧とエントリのスナップショットを入れ替える（変更のないパスは共有したまま）
+        current = self.spline_manager.snapshot()
+        self.spline_manager.restore(state['paths'])
+        state['paths'] = current
 
     def undo(self):
-        if not self.undo_stack:
+        self.end_raster_stroke()
+        state = self.history.pop_undo()
+        if state is None:
             return
-        state = self.undo_stack.pop()
-        self.redo_stack.append({
-            'raster_layer': self.raster_layer.copy(),
-            'spline_manager': self.spline_manager.copy()
-        })
-        self.raster_layer = state['raster_layer']
-        self.spline_manager = state['spline_manager']
-        self.spline_manager.drawing_area = self
-        for path in self.spline_manager.paths:
-            path.drawing_area = self
+        if state['raster'] is not None:
+            state['raster'].undo(self.raster_layer)
+            self.raster_layer_blank = False
+        self.swap_path_document(state)
+        self.history.append_redo(state)
         self.update_vector_layer()
         self.update()
 
     def redo(self):
-        if not self.redo_stack:
+        self.end_raster_stroke()
+        state = self.history.pop_redo()
+        if state is None:
             return
-        state = self.redo_stack.pop()
-        self.undo_stack.append({
-            'raster_layer': self.raster_layer.copy(),
-            'spline_manager': self.spline_manager.copy()
-        })
-        self.raster_layer = state['raster_layer']
-        self.spline_manager = state['spline_manager']
-        self.spline_manager.drawing_area = self
+        if state['raster'] is not None:
+            state['raster'].redo(self.raster_layer)
+            self.raster_layer_blank = False
+        self.swap_path_document(state)
+        self.history.append_undo(state)
         self.update_vector_layer()
         self.update()
 
     def update_vector_layer(self):
-        self.vector_layer.fill(Qt.transparent)
-        painter = QPainter(self.vector_layer)
-        painter.setRenderHint(QPainter.Antialiasing)
-
-        for path in self.spline_manager.paths:
-            pen = QPen(path.pen_color, path.pen_width)
-            painter.setPen(pen)
-            if path.fill_enabled:
-                brush = QBrush(path.fill_color)
-                painter.setBrush(brush)
-            else:
-                painter.setBrush(Qt.NoBrush)
-            painter.drawPath(path.path)
-        painter.end()
+        # 確定時（マウスリリース・Undo・クリア等）に呼ばれる。実際の再描画は必要になった時に行う
+        self.static_vector_layer_dirty = True
+        self.invalidate_composite()
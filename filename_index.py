@@ -0,0 +1,69 @@
+# filename_index.py
+
+import os
+
+
+class FilenameIndex:
+    # 保存先フォルダごとのファイル名の一覧。フォルダは最初に一度だけ os.scandir で読み、
+    # 以降は割り当てた名前を追加していくので、保存のたびにファイルの有無を順に調べずに済む
+    def __init__(self):
+        self.folders = {}
+        # (フォルダ, ファイル名) ごとに次に試す連番
+        self.next_suffix = {}
+
+    @staticmethod
+    def folder_key(folder):
+        return os.path.normcase(os.path.normpath(folder))
+
+    def names(self, folder):
+        names = self.folders.get(self.folder_key(folder))
+        if names is None:
+            names = set()
+            try:
+                with os.scandir(folder) as entries:
+                    names.update(os.path.normcase(entry.name) for entry in entries)
+            except OSError:
+                pass
+            self.folders[self.folder_key(folder)] = names
+        return names
+
+    def allocate(self, folder, filename):
+        # 空いている名前を予約してフルパスを返す。使用中なら name_1.ext, name_2.ext ... とする
+        names = self.names(folder)
+        name, ext = os.path.splitext(filename)
+        key = (self.folder_key(folder), os.path.normcase(filename))
+        counter = self.next_suffix.get(key, 0)
+        while True:
+            candidate = f"{name}_{counter}{ext}" if counter > 0 else f"{name}{ext}"
+            normalized = os.path.normcase(candidate)
+            full_path = os.path.join(folder, candidate)
+            # 一覧を作った後に外から置かれたファイルに備え、空いていそうな名前だけはディスクでも確かめる
+            if normalized not in names and not os.path.exists(full_path):
+                break
+            names.add(normalized)
+            counter += 1
+        names.add(normalized)
+        self.next_suffix[key] = counter + 1
+        return full_path
+
+    def discard(self, path):
+        # 書き込みに失敗した名前を空きに戻す
+        folder, filename = os.path.split(path)
+        names = self.folders.get(self.folder_key(folder))
+        if names is not None:
+            names.discard(os.path.normcase(filename))
+            self.forget_suffixes(folder)
+
+    def invalidate(self, folder, pending=()):
+        # 次に使う時にフォルダを読み直す。書き込み待ちのパス（pending）の名前は予約したまま残す
+        self.folders.pop(self.folder_key(folder), None)
+        self.forget_suffixes(folder)
+        for path in pending:
+            directory, filename = os.path.split(path)
+            if self.folder_key(directory) == self.folder_key(folder):
+                self.names(folder).add(os.path.normcase(filename))
+
+    def forget_suffixes(self, folder):
+        folder = self.folder_key(folder)
+        for key in [key for key in self.next_suffix if key[0] == folder]:
+            del self.next_suffix[key]
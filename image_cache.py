@@ -0,0 +1,114 @@
+# image_cache.py
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtGui import QImage
+
+MEGABYTE = 1024 * 1024
+
+
+def decode_image(path):
+    # QImage はワーカースレッドで扱える。QPixmap がそのまま使える形式へ変換まで済ませておく
+    # （不透明な画像を ARGB にすると QPixmap 化の際に全画素の走査と再変換が起きる）
+    image = QImage(path)
+    if image.isNull():
+        return image
+    if image.hasAlphaChannel():
+        return image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+    return image.convertToFormat(QImage.Format_RGB32)
+
+
+class ImageCache:
+    # デコード済み画像をバイト数の上限つきで保持する LRU キャッシュ
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.images = OrderedDict()
+        self.total_bytes = 0
+
+    def __contains__(self, path):
+        return path in self.images
+
+    def get(self, path):
+        image = self.images.get(path)
+        if image is not None:
+            self.images.move_to_end(path)
+        return image
+
+    def put(self, path, image):
+        if image.isNull():
+            return
+        self.discard(path)
+        self.images[path] = image
+        self.total_bytes += image.sizeInBytes()
+        self.evict()
+
+    def discard(self, path):
+        image = self.images.pop(path, None)
+        if image is not None:
+            self.total_bytes -= image.sizeInBytes()
+
+    def evict(self):
+        # 最後に使った 1 枚は上限を超えていても残す
+        while self.total_bytes > self.max_bytes and len(self.images) > 1:
+            _, image = self.images.popitem(last=False)
+            self.total_bytes -= image.sizeInBytes()
+
+    def clear(self):
+        self.images.clear()
+        self.total_bytes = 0
+
+
+class ImageLoader(QObject):
+    # 画像のデコードをスレッドプールで行い、結果を ImageCache に入れる
+    loaded = pyqtSignal(str, object)
+
+    def __init__(self, cache_mb=512, max_workers=2):
+        super().__init__()
+        self.cache = ImageCache(int(cache_mb * MEGABYTE))
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image_loader')
+        self.futures = {}
+        self.loaded.connect(self.on_loaded)
+
+    def request(self, path):
+        if path in self.cache or path in self.futures:
+            return
+        future = self.executor.submit(decode_image, path)
+        self.futures[path] = future
+        future.add_done_callback(lambda done: self.loaded.emit(path, done))
+
+    def prefetch(self, paths):
+        for path in paths:
+            self.request(path)
+
+    def on_loaded(self, path, future):
+        if self.futures.get(path) is not future:
+            return
+        del self.futures[path]
+        if future.exception() is None:
+            self.cache.put(path, future.result())
+        else:
+            print(f"Could not load image {path}: {future.exception()}")
+
+    def load(self, path):
+        # キャッシュにあればそのまま、先読み中なら完了を待ち、なければこのスレッドでデコードする
+        image = self.cache.get(path)
+        if image is not None:
+            return image
+        future = self.futures.pop(path, None)
+        if future is not None and future.exception() is None:
+            image = future.result()
+        else:
+            image = decode_image(path)
+        self.cache.put(path, image)
+        return image
+
+    def clear(self):
+        for future in self.futures.values():
+            future.cancel()
+        self.futures.clear()
+        self.cache.clear()
+
+    def shutdown(self):
+        self.clear()
+        self.executor.shutdown(wait=False)
@@ -1,9 +1,16 @@
 import sys
+from startup_timer import startup_timer
 from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import QTimer
 from paint_app import PaintApp
 
 if __name__ == '__main__':
+    startup_timer.mark('imports')
     app = QApplication(sys.argv)
+    startup_timer.mark('QApplication')
     paint_app = PaintApp()
     paint_app.show()
+    startup_timer.mark('show window')
+    # イベントループが回り始めた時点（最初の描画の直後）で集計する
+    QTimer.singleShot(0, lambda: (startup_timer.mark('first event loop'), startup_timer.report()))
     sys.exit(app.exec_())
\ No newline at end of file
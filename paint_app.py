@@ -1,11 +1,17 @@
 from PyQt5.QtWidgets import QMainWindow, QWidget, QVBoxLayout, QSizePolicy, QAction, QFileDialog, QMessageBox
-from PyQt5.QtGui import QColor, QPixmap
-from PyQt5.QtCore import QSize, Qt
+from PyQt5.QtGui import QColor, QPainterPath
+from PyQt5.QtCore import QSize, Qt, QTimer
 from drawing_area import DrawingArea
 from settings_manager import SettingsManager
 from settings_dialog import SettingsDialog
 from path_tool_settings_window import PathToolSettingsWindow
+from startup_timer import startup_timer
+from cycle_timer import cycle_timer
+from image_cache import ImageLoader
+from save_writer import SaveWriter, write_png, write_svg
+from filename_index import FilenameIndex
 import os
+import time
 import yaml
 
 
@@ -72,6 +78,9 @@ class PaintApp(QMainWindow):
         self.default_simplify_tolerance = 1
         self.default_smooth_strength = 1
         self.path_hit_threshold = 2.0
+        self.path_spline_mode = 'interpolate'  # または 'catmull_rom'
+        self.path_curve_backend = 'polyline'  # または 'bezier'
+        self.path_bezier_tolerance = 0.5
 
         # 手ブレ補正の度合いを初期化
         self.stabilization_degree = 0
@@ -79,29 +88,52 @@ class PaintApp(QMainWindow):
         # Deleteモードのデフォルト設定
         self.delete_mode = 'Delete Current Tool'  # または 'Delete All'
 
+        # Undo履歴のメモリ/ディスク予算（MB）
+        self.undo_memory_budget_mb = 512
+        self.undo_disk_budget_mb = 2048
+
+        # 画像フォルダの先読み（前後の枚数）とデコード済み画像キャッシュの上限（MB）
+        self.image_prefetch_count = 2
+        self.image_cache_mb = 512
+
+        # 設定の読み込み（一度だけ）。DrawingArea が読み込んだ値で初期化されるよう先に行う
+        self.settings_manager = SettingsManager(self)
+        startup_timer.mark('settings')
+
         # DrawingArea の初期化
         self.drawing_area = DrawingArea(self)
         self.drawing_area.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
         layout = QVBoxLayout(self.central_widget)
         layout.addWidget(self.drawing_area)
+        startup_timer.mark('drawing area')
 
-        self.settings_manager = SettingsManager(self)
         self.load_language()
+        startup_timer.mark('language')
 
         self.create_menu()
         self.resize(self.default_canvas_size)
         self.create_default_image()
         self.update_cursor()
 
-        # 設定の読み込み
-        self.settings_manager.load_settings()
-
         # 手ブレ補正の度合いを適用
         self.drawing_area.set_stabilization_degree(self.stabilization_degree)
+        self.drawing_area.history.set_budget(self.undo_memory_budget_mb, self.undo_disk_budget_mb)
+        self.image_loader = ImageLoader(self.image_cache_mb)
+        # PNG/SVG のエンコードと書き込みは裏で行う
+        self.save_writer = SaveWriter()
+        self.save_writer.saved.connect(self.on_image_saved)
+        self.save_writer.failed.connect(self.on_save_failed)
+        # 保存先フォルダのファイル名一覧（連番の重複回避用）
+        self.filename_index = FilenameIndex()
+        startup_timer.mark('menu and canvas')
+
+        # NumPy/SciPy はパスツールを使うまで読み込まない。ウィンドウ表示後に裏で読み込んでおく
+        QTimer.singleShot(0, self.drawing_area.spline_manager.preload_modules)
 
     def update_background_color(self):
         if not self.drawing_area.original_pixmap:
             self.drawing_area.background_color = self.background_color
+            self.drawing_area.invalidate_composite()
             self.drawing_area.update()
 
     def create_key_mappings(self):
@@ -150,7 +182,7 @@ class PaintApp(QMainWindow):
         language_file = os.path.join(language_folder, f'language_{self.language_code}.yaml')
         try:
             with open(language_file, 'r', encoding='utf-8') as f:
-                self.translations = yaml.safe_load(f)
+                self.translations = yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
         except Exception as e:
             print(f"Could not load language file: {e}")
             self.translations = {}
@@ -216,6 +248,7 @@ class PaintApp(QMainWindow):
             'Delete Mode': 'Delete Mode',
             'Delete Current Tool': 'Delete Current Tool',
             'Delete All': 'Delete All',
+            'Could not save the image.': 'Could not save the image.',
         }
         for key, value in default_translations.items():
             if key not in self.translations:
@@ -249,14 +282,16 @@ class PaintApp(QMainWindow):
             self.update_cursor()
             self.update_gui_texts()
             self.settings_manager.save_settings()
-            self.drawing_area.undo_stack.clear()
-            self.drawing_area.redo_stack.clear()
+            self.drawing_area.clear_history()
 
     def select_folder(self):
         self.folder_path = QFileDialog.getExistingDirectory(self, "Select Folder")
         if self.folder_path:
             self.image_files = [f for f in os.listdir(self.folder_path) if f.lower().endswith(
                 ('.png', '.jpg', '.webp', '.gif', '.bmp', '.jpeg'))]
+            self.image_loader.clear()
+            # 保存先を指定していなければこのフォルダに保存するので、ファイル名の一覧を読み直す
+            self.filename_index.invalidate(self.folder_path, self.save_writer.futures)
             if self.image_files:
                 self.load_image(0)
             else:
@@ -265,10 +300,23 @@ class PaintApp(QMainWindow):
     def load_image(self, index):
         if 0 <= index < len(self.image_files):
             image_path = os.path.join(self.folder_path, self.image_files[index])
-            self.drawing_area.set_image(QPixmap(image_path))
+            self.drawing_area.set_image(self.image_loader.load(image_path))
             self.current_image_index = index
-            self.drawing_area.undo_stack.clear()
-            self.drawing_area.redo_stack.clear()
+            self.drawing_area.clear_history()
+            self.prefetch_images(index)
+            # 再描画の要求より後に処理されるので、実際に表示された時点の計測になる
+            QTimer.singleShot(0, cycle_timer.image_shown)
+            # 表示した後の空き時間に、次の画像送り用の空レイヤーを用意しておく
+            QTimer.singleShot(0, self.drawing_area.prepare_idle_layers)
+
+    def prefetch_images(self, index):
+        # 近い順に前後の画像をワーカーでデコードしておく
+        count = len(self.image_files)
+        paths = []
+        for offset in range(1, min(self.image_prefetch_count, count // 2) + 1):
+            for neighbor in (index + offset, index - offset):
+                paths.append(os.path.join(self.folder_path, self.image_files[neighbor % count]))
+        self.image_loader.prefetch(paths)
 
     def create_default_image(self):
         self.drawing_area.create_default_image(self.default_canvas_size)
@@ -280,19 +328,17 @@ class PaintApp(QMainWindow):
         folder = QFileDialog.getExistingDirectory(self, self.translations['Select Save Folder'])
         if folder:
             self.save_folder = folder
+            # 選び直したフォルダは、外で増減したファイルも含めて読み直す
+            self.filename_index.invalidate(folder, self.save_writer.futures)
             self.settings_manager.save_settings()
 
     def get_unique_filename(self, folder, base_filename):
-        name, ext = os.path.splitext(base_filename)
-        counter = 0
-        while True:
-            filename = f"{name}_{counter}{ext}" if counter > 0 else f"{name}{ext}"
-            full_path = os.path.join(folder, filename)
-            if not os.path.exists(full_path):
-                return full_path
-            counter += 1
+        # 書き込み待ちの名前も予約済みとして一覧に入っている
+        return self.filename_index.allocate(folder, base_filename)
 
     def save_image(self):
+        save_started = time.perf_counter()
+        self.drawing_area.spline_manager.finish_pending_paths()
         save_folder = self.save_folder if self.save_folder else self.folder_path
         if not save_folder:
             save_folder = QFileDialog.getExistingDirectory(self, self.translations["Select Save Folder"])
@@ -300,73 +346,80 @@ class PaintApp(QMainWindow):
                 return
             self.save_folder = save_folder
 
+        # ファイル名は書き込みを渡す直前に割り当てる（保存しない時に名前を予約しないように）
         base_filename = self.save_name_template.format(self.save_counter)
-        # ファイル拡張子を決定
-        if self.save_mode == 2:
-            ext = ".svg"
-        else:
-            ext = ".png"
-        save_path = self.get_unique_filename(save_folder, base_filename + ext)
 
         if self.save_mode == 1:
             # ペンツールのみセーブ（ラスターレイヤー）
-            if not self.drawing_area.raster_layer.isNull():
-                self.drawing_area.raster_layer.save(save_path, "PNG")
-                print(f"Pen tool layer saved as {save_path}")
-            else:
+            if self.drawing_area.raster_layer.isNull():
                 print("No raster layer to save.")
+                return
+            raster_image = self.drawing_area.raster_layer.toImage()
+            save_path = self.get_unique_filename(save_folder, base_filename + ".png")
+            self.save_writer.submit(save_path, write_png, raster_image.size(), [raster_image])
 
         elif self.save_mode == 2:
             # パスツールのみセーブ（SVG形式）
-            if self.drawing_area.spline_manager.paths:
-                self.save_paths_as_svg(save_path)
-                print(f"Path tool layer saved as {save_path}")
-            else:
+            if not self.drawing_area.spline_manager.paths:
                 print("No paths to save.")
+                return
+            self.save_paths_as_svg(self.get_unique_filename(save_folder, base_filename + ".svg"))
         elif self.save_mode == 3:
             # ペンツールとパスツールのレイヤーを結合して保存
-            if not self.drawing_area.raster_layer.isNull():
-                merged_image = QPixmap(self.drawing_area.raster_layer.size())
-                merged_image.fill(Qt.transparent)
-                painter = QPainter(merged_image)
-                if self.drawing_area.original_pixmap:
-                    painter.drawPixmap(0, 0, self.drawing_area.original_pixmap)
-                else:
-                    painter.fillRect(merged_image.rect(), self.background_color)
-                painter.drawPixmap(0, 0, self.drawing_area.raster_layer)
-                painter.drawPixmap(0, 0, self.drawing_area.vector_layer)
-                painter.end()
-                merged_image.save(save_path, "PNG")
-                print(f"Merged image saved as {save_path}")
-            else:
+            if self.drawing_area.raster_layer.isNull():
                 print("No raster layer to save.")
+                return
+            save_path = self.get_unique_filename(save_folder, base_filename + ".png")
+            self.save_writer.submit(save_path, write_png, *self.merged_layers())
         else:
             print("Invalid save mode.")
+            return
 
+        # 書き込みを受け付けた時だけ番号を進め、次の画像へ送る
         self.save_counter += 1
         self.settings_manager.save_settings()
+        self.advance_after_save(save_started)
+
+    def advance_after_save(self, save_started):
+        # 書き込みはワーカーがレイヤーのコピーで行うので、保存を待たずに次の画像へ進める
+        if not (self.auto_advance and self.image_files):
+            return
+        cycle_timer.save(save_started)
+        # 保存して次へ進む時は、パスも空の状態から始める（矢印キーでの移動ではパスを残す）
+        self.drawing_area.spline_manager.clear_paths()
+        self.load_next_image()
+
+    def path_snapshots(self):
+        # パスの形状と色をコピーして取り出す（描画・SVG 化はワーカーで行う）
+        return [(QPainterPath(path.transformed_path()), QColor(path.pen_color), path.pen_width,
+                 QColor(path.fill_color) if path.fill_enabled else None)
+                for path in self.drawing_area.spline_manager.paths]
+
+    def merged_layers(self):
+        # 保存用に各レイヤーを QImage として取り出す。合成とパスの描画は書き込み側で行う
+        size = self.drawing_area.raster_layer.size()
+        if self.drawing_area.original_image is not None:
+            background = self.drawing_area.original_image
+        else:
+            background = QColor(self.background_color)
+        return size, [self.drawing_area.raster_layer.toImage()], background, self.path_snapshots()
 
     def save_paths_as_svg(self, save_path):
-        from xml.etree.ElementTree import Element, SubElement, ElementTree
-        svg = Element('svg', xmlns="http://www.w3.org/2000/svg")
-        width = str(self.drawing_area.vector_layer.width())
-        height = str(self.drawing_area.vector_layer.height())
-        svg.set('width', width)
-        svg.set('height', height)
-        svg.set('viewBox', f"0 0 {width} {height}")
-
-        for path in self.drawing_area.spline_manager.paths:
-            path_element = SubElement(svg, 'path')
-            d = path.path_to_svg_d()
-            path_element.set('d', d)
-            path_element.set('fill', 'none' if not path.fill_enabled else path.fill_color.name())
-            path_element.set('stroke', path.pen_color.name())
-            path_element.set('stroke-width', str(path.pen_width))
-
-        tree = ElementTree(svg)
-        tree.write(save_path)
+        self.save_writer.submit(save_path, write_svg, self.drawing_area.raster_layer.width(),
+                                self.drawing_area.raster_layer.height(), self.path_snapshots())
+
+    def on_image_saved(self, save_path):
+        print(f"Saved {save_path}")
+
+    def on_save_failed(self, save_path, message):
+        self.filename_index.discard(save_path)
+        print(f"Could not save {save_path}: {message}")
+        QMessageBox.warning(self, self.translations['Warning'],
+                            f"{self.translations['Could not save the image.']}\n{save_path}\n{message}")
 
     def save_merged_image(self):
+        save_started = time.perf_counter()
+        self.drawing_area.spline_manager.finish_pending_paths()
         if not self.drawing_area.raster_layer.isNull():
             save_folder = self.save_folder if self.save_folder else self.folder_path
             if not save_folder:
@@ -379,23 +432,11 @@ class PaintApp(QMainWindow):
             save_path = self.get_unique_filename(save_folder, base_filename)
 
             # ラスターレイヤーとベクターレイヤーを統合して保存
-            merged_image = QPixmap(self.drawing_area.raster_layer.size())
-            merged_image.fill(Qt.transparent)
-            painter = QPainter(merged_image)
-            if self.drawing_area.original_pixmap:
-                painter.drawPixmap(0, 0, self.drawing_area.original_pixmap)
-            else:
-                painter.fillRect(merged_image.rect(), self.background_color)
-            painter.drawPixmap(0, 0, self.drawing_area.raster_layer)
-            # ベクターレイヤーを描画
-            painter.drawPixmap(0, 0, self.drawing_area.vector_layer)
-            painter.end()
-
-            merged_image.save(save_path, "PNG")
-            print(f"Merged image saved as {save_path}")
+            self.save_writer.submit(save_path, write_png, *self.merged_layers())
 
             self.save_counter += 1
             self.settings_manager.save_settings()
+            self.advance_after_save(save_started)
         else:
             print("No raster layer to save.")
 
@@ -417,11 +458,9 @@ class PaintApp(QMainWindow):
             # モード切替
             if self.drawing_area.mode == 'draw':
                 self.drawing_area.mode = 'spline'
-                self.drawing_area.current_layer = self.drawing_area.vector_layer
                 print("Mode switched to spline")
             else:
                 self.drawing_area.mode = 'draw'
-                self.drawing_area.current_layer = self.drawing_area.raster_layer
                 print("Mode switched to draw")
             return
 
@@ -550,6 +589,17 @@ class PaintApp(QMainWindow):
         self.drawing_area.setFixedSize(new_size)
         self.resize(self.sizeHint())
 
+    def closeEvent(self, event):
+        # 書き込み待ちの保存を終わらせてから、各ワーカーを止める
+        self.save_writer.shutdown()
+        self.image_loader.shutdown()
+        self.settings_manager.flush()
+        cycle_timer.report()
+        self.drawing_area.spline_manager.path_finalizer.shutdown()
+        # 履歴の退避ファイルを閉じる
+        self.drawing_area.history.close()
+        super().closeEvent(event)
+
     def resizeEvent(self, event):
         super().resizeEvent(event)
         self.drawing_area.update()
@@ -0,0 +1,19 @@
+# path_document.py
+
+
+class PathDocument:
+    # パス一覧の不変スナップショット。変更されていない VectorPath は履歴間で共有される
+    __slots__ = ('paths', 'selected')
+
+    def __init__(self, paths=(), selected=()):
+        self.paths = tuple(paths)
+        self.selected = tuple(selected)
+
+    @classmethod
+    def capture(cls, paths, selected_paths):
+        paths = tuple(paths)
+        selected = [paths.index(path) for path in selected_paths if path in paths]
+        return cls(paths, selected)
+
+    def selected_paths(self):
+        return [self.paths[index] for index in self.selected]
@@ -0,0 +1,40 @@
+# path_finalizer.py
+
+import importlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QObject, pyqtSignal
+
+
+class PathFinalizer(QObject):
+    # パスの確定処理（間引き・平滑化・スプラインフィット）をワーカースレッドで行う。
+    # 結果は finished シグナルでメインスレッドに戻る
+    finished = pyqtSignal(object, object)
+
+    def __init__(self, max_workers=None):
+        super().__init__()
+        if max_workers is None:
+            max_workers = min(4, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='path_finalizer')
+        self.futures = {}
+
+    def submit(self, token, func, *args):
+        future = self.executor.submit(func, *args)
+        self.futures[token] = future
+        future.add_done_callback(lambda done: self.finished.emit(token, done))
+
+    def preload(self, *module_names):
+        # 重いモジュールの import をワーカーで先に済ませておく
+        for name in module_names:
+            self.executor.submit(importlib.import_module, name)
+
+    def take(self, token):
+        # 結果を受け取る側が一度だけ処理できるように取り出す
+        return self.futures.pop(token, None)
+
+    def pending_tokens(self):
+        return list(self.futures)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        self.futures.clear()
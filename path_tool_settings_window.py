@@ -58,7 +58,7 @@ class PathToolSettingsWindow(QDialog):
     def change_pen_width(self, value):
         self.main_window.pen_size = value
         self.main_window.drawing_area.pen_size = value
-        for vp in self.main_window.drawing_area.spline_manager.selected_paths:
+        for vp in self.main_window.drawing_area.spline_manager.detach_selected_paths():
             vp.pen_width = value
             vp.generate_path_from_bspline()
         self.main_window.drawing_area.update()
@@ -69,20 +69,20 @@ class PathToolSettingsWindow(QDialog):
         if color.isValid():
             self.main_window.colors[self.main_window.current_color_index] = color
             self.pen_color_button.setStyleSheet(f"background-color: {color.name()}")
-            for vp in self.main_window.drawing_area.spline_manager.selected_paths:
+            for vp in self.main_window.drawing_area.spline_manager.detach_selected_paths():
                 vp.pen_color = color
             self.main_window.drawing_area.update()
 
     def change_simplify_tolerance(self, value):
         self.main_window.default_simplify_tolerance = value
-        for vp in self.main_window.drawing_area.spline_manager.selected_paths:
-            vp.simplify_path(value)
-            vp.generate_path_from_bspline()
+        spline_manager = self.main_window.drawing_area.spline_manager
+        spline_manager.reprocess_paths(spline_manager.detach_selected_paths(), value,
+                                       self.main_window.default_smooth_strength)
         self.main_window.drawing_area.update()
 
     def change_smooth_strength(self, value):
         self.main_window.default_smooth_strength = value
-        for vp in self.main_window.drawing_area.spline_manager.selected_paths:
-            vp.smooth_path(value)
-            vp.generate_path_from_bspline()
+        spline_manager = self.main_window.drawing_area.spline_manager
+        spline_manager.reprocess_paths(spline_manager.detach_selected_paths(),
+                                       self.main_window.default_simplify_tolerance, value)
         self.main_window.drawing_area.update()
@@ -0,0 +1,142 @@
+# raster_undo.py
+
+import pickle
+import zlib
+from PyQt5.QtGui import QPainter, QImage
+from PyQt5.QtCore import Qt, QRect
+
+TILE_SIZE = 64
+
+
+class RasterDelta:
+    # ストロークが触れたタイルだけを変更前/変更後で保持する
+    def __init__(self, tile_size=TILE_SIZE):
+        self.tile_size = tile_size
+        self.before = {}
+        self.after = {}
+        self.committed = False
+        self.size_cache = None
+        self.spill_record = None
+
+    def tile_keys(self, layer, rect):
+        rect = rect.intersected(layer.rect())
+        if rect.isEmpty():
+            return []
+        ts = self.tile_size
+        return [(tx, ty)
+                for ty in range(rect.top() // ts, rect.bottom() // ts + 1)
+                for tx in range(rect.left() // ts, rect.right() // ts + 1)]
+
+    def tile_rect(self, layer, key):
+        ts = self.tile_size
+        return QRect(key[0] * ts, key[1] * ts, ts, ts).intersected(layer.rect())
+
+    def grab_tiles(self, layer, keys):
+        if not keys:
+            return {}
+        bounds = QRect()
+        for key in keys:
+            bounds = bounds.united(self.tile_rect(layer, key))
+        # レイヤー全体ではなく対象範囲だけを一度で QImage に変換する
+        source = layer.copy(bounds).toImage()
+        tiles = {}
+        for key in keys:
+            rect = self.tile_rect(layer, key)
+            tiles[key] = source.copy(rect.translated(-bounds.topLeft()))
+        return tiles
+
+    def capture(self, layer, rect):
+        if self.committed:
+            return
+        keys = [key for key in self.tile_keys(layer, rect) if key not in self.before]
+        self.before.update(self.grab_tiles(layer, keys))
+
+    def commit(self, layer, cleared=False):
+        if self.committed:
+            return
+        if cleared:
+            self.after = {key: None for key in self.before}
+        else:
+            self.after = self.grab_tiles(layer, list(self.before))
+        self.committed = True
+        self.size_cache = None
+
+    def apply(self, layer, tiles):
+        dirty = QRect()
+        if not tiles:
+            return dirty
+        painter = QPainter(layer)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        for key, image in tiles.items():
+            rect = self.tile_rect(layer, key)
+            if image is None:
+                painter.fillRect(rect, Qt.transparent)
+            else:
+                painter.drawImage(rect.topLeft(), image)
+            dirty = dirty.united(rect)
+        painter.end()
+        return dirty
+
+    def undo(self, layer):
+        return self.apply(layer, self.before)
+
+    def redo(self, layer):
+        return self.apply(layer, self.after)
+
+    def is_empty(self):
+        return not self.before and self.spill_record is None
+
+    def nbytes(self):
+        if self.size_cache is not None:
+            return self.size_cache
+        total = 0
+        for tiles in (self.before, self.after):
+            for image in tiles.values():
+                if image is not None:
+                    total += image.sizeInBytes()
+        if self.committed:
+            self.size_cache = total
+        return total
+
+    def is_spilled(self):
+        return self.spill_record is not None
+
+    @staticmethod
+    def pack_tiles(tiles):
+        packed = {}
+        for key, image in tiles.items():
+            if image is None:
+                packed[key] = None
+            else:
+                packed[key] = (image.width(), image.height(), image.bytesPerLine(), int(image.format()),
+                               image.constBits().asstring(image.sizeInBytes()))
+        return packed
+
+    @staticmethod
+    def unpack_tiles(packed):
+        tiles = {}
+        for key, value in packed.items():
+            if value is None:
+                tiles[key] = None
+            else:
+                width, height, bytes_per_line, image_format, data = value
+                tiles[key] = QImage(data, width, height, bytes_per_line, QImage.Format(image_format)).copy()
+        return tiles
+
+    def dump(self, level=1):
+        payload = (self.pack_tiles(self.before), self.pack_tiles(self.after))
+        return zlib.compress(pickle.dumps(payload, pickle.HIGHEST_PROTOCOL), level)
+
+    def release(self, spill_record):
+        # タイルはディスクに退避済み。メモリからは解放する
+        self.spill_record = spill_record
+        self.before = {}
+        self.after = {}
+        self.size_cache = 0
+
+    def restore_dump(self, data):
+        before, after = pickle.loads(zlib.decompress(data))
+        self.before = self.unpack_tiles(before)
+        self.after = self.unpack_tiles(after)
+        self.spill_record = None
+        self.size_cache = None
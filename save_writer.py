@@ -0,0 +1,123 @@
+# save_writer.py
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from xml.etree.ElementTree import Element, SubElement, ElementTree
+from PyQt5.QtCore import QObject, Qt, pyqtSignal
+from PyQt5.QtGui import QBrush, QImage, QPainter, QPainterPath, QPen
+
+
+def compose_image(size, layers, background=None, paths=()):
+    # layers は下から順に重ねる QImage。background は下地の QImage か QColor。
+    # paths（パスのスナップショット）は最後に上に描く
+    image = QImage(size, QImage.Format_ARGB32_Premultiplied)
+    image.fill(Qt.transparent)
+    painter = QPainter(image)
+    if isinstance(background, QImage):
+        painter.drawImage(0, 0, background)
+    elif background is not None:
+        painter.fillRect(image.rect(), background)
+    for layer in layers:
+        painter.drawImage(0, 0, layer)
+    painter.setRenderHint(QPainter.Antialiasing)
+    for painter_path, pen_color, pen_width, fill_color in paths:
+        painter.setPen(QPen(pen_color, pen_width))
+        painter.setBrush(QBrush(fill_color) if fill_color is not None else Qt.NoBrush)
+        painter.drawPath(painter_path)
+    painter.end()
+    return image
+
+
+def write_png(save_path, size, layers, background=None, paths=()):
+    if background is None and len(layers) == 1 and not paths:
+        image = layers[0]
+    else:
+        image = compose_image(size, layers, background, paths)
+    if not image.save(save_path, "PNG"):
+        raise OSError(f"Could not write {save_path}")
+
+
+def painter_path_to_svg_d(path):
+    elements = []
+    i = 0
+    while i < path.elementCount():
+        elem = path.elementAt(i)
+        if elem.type == QPainterPath.ElementType.MoveToElement:
+            elements.append(f"M {elem.x} {elem.y}")
+        elif elem.type == QPainterPath.ElementType.LineToElement:
+            elements.append(f"L {elem.x} {elem.y}")
+        elif elem.type == QPainterPath.ElementType.CurveToElement:
+            cp1 = elem
+            i += 1
+            cp2 = path.elementAt(i)
+            i += 1
+            end = path.elementAt(i)
+            elements.append(f"C {cp1.x} {cp1.y} {cp2.x} {cp2.y} {end.x} {end.y}")
+        elif elem.type == QPainterPath.ElementType.CurveToDataElement:
+            pass
+        i += 1
+    return ' '.join(elements)
+
+
+def write_svg(save_path, width, height, paths):
+    # paths: (QPainterPath, 線の色, 線の太さ, 塗りの色 or None) のリスト
+    svg = Element('svg', xmlns="http://www.w3.org/2000/svg")
+    svg.set('width', str(width))
+    svg.set('height', str(height))
+    svg.set('viewBox', f"0 0 {width} {height}")
+
+    for painter_path, pen_color, pen_width, fill_color in paths:
+        path_element = SubElement(svg, 'path')
+        path_element.set('d', painter_path_to_svg_d(painter_path))
+        path_element.set('fill', 'none' if fill_color is None else fill_color.name())
+        path_element.set('stroke', pen_color.name())
+        path_element.set('stroke-width', str(pen_width))
+
+    ElementTree(svg).write(save_path)
+
+
+class SaveWriter(QObject):
+    # 画像のエンコードと書き込みをワーカースレッドで順番に行う。
+    # 待ちが max_pending に達したら、古いものが書き終わるまで呼び出し側を待たせる
+    done = pyqtSignal(str, object)
+    saved = pyqtSignal(str)
+    failed = pyqtSignal(str, str)
+
+    def __init__(self, max_pending=4):
+        super().__init__()
+        self.max_pending = max_pending
+        # 書き込み順を保つため 1 スレッドで処理する
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='save_writer')
+        self.futures = OrderedDict()
+        self.done.connect(self.on_done)
+
+    def submit(self, save_path, func, *args):
+        while len(self.futures) >= self.max_pending:
+            oldest_path, oldest = next(iter(self.futures.items()))
+            wait([oldest])
+            self.on_done(oldest_path, oldest)
+        future = self.executor.submit(func, save_path, *args)
+        self.futures[save_path] = future
+        future.add_done_callback(lambda finished: self.done.emit(save_path, finished))
+
+    def on_done(self, save_path, future):
+        # submit や flush で先に処理済みなら、後から届いたシグナルは無視する
+        if self.futures.get(save_path) is not future:
+            return
+        del self.futures[save_path]
+        error = future.exception()
+        if error is None:
+            self.saved.emit(save_path)
+        else:
+            self.failed.emit(save_path, str(error))
+
+    def flush(self):
+        # 待ちになっている保存をすべて書き終えるまで待つ
+        while self.futures:
+            save_path, future = next(iter(self.futures.items()))
+            wait([future])
+            self.on_done(save_path, future)
+
+    def shutdown(self):
+        self.flush()
+        self.executor.shutdown(wait=True)
@@ -200,6 +200,28 @@ class SettingsDialog(QDialog):
         layout.addLayout(hit_threshold_layout, row, 1)
         row += 1
 
+        # 新しく描くパスのスプラインの種類
+        layout.addWidget(QLabel(self.main_window.translations.get('Spline Mode', 'Spline Mode')), row, 0)
+        self.spline_mode_combo = QComboBox()
+        self.spline_mode_combo.addItem(self.main_window.translations.get('Interpolating Spline', 'Interpolating Spline'), 'interpolate')
+        self.spline_mode_combo.addItem(self.main_window.translations.get('Catmull-Rom Spline', 'Catmull-Rom Spline'), 'catmull_rom')
+        index = self.spline_mode_combo.findData(self.main_window.path_spline_mode)
+        if index != -1:
+            self.spline_mode_combo.setCurrentIndex(index)
+        layout.addWidget(self.spline_mode_combo, row, 1)
+        row += 1
+
+        # 新しく描くパスの曲線の表現（折れ線かベジェ列か）
+        layout.addWidget(QLabel(self.main_window.translations.get('Curve Backend', 'Curve Backend')), row, 0)
+        self.curve_backend_combo = QComboBox()
+        self.curve_backend_combo.addItem(self.main_window.translations.get('Polyline', 'Polyline'), 'polyline')
+        self.curve_backend_combo.addItem(self.main_window.translations.get('Bezier Curves', 'Bezier Curves'), 'bezier')
+        index = self.curve_backend_combo.findData(self.main_window.path_curve_backend)
+        if index != -1:
+            self.curve_backend_combo.setCurrentIndex(index)
+        layout.addWidget(self.curve_backend_combo, row, 1)
+        row += 1
+
         self.basic_settings_tab.setLayout(layout)
 
     def change_background_color(self):
@@ -391,6 +413,8 @@ class SettingsDialog(QDialog):
         self.main_window.default_simplify_tolerance = self.simplify_slider.value()
         self.main_window.default_smooth_strength = self.smooth_slider.value()
         self.main_window.path_hit_threshold = self.hit_threshold_slider.value() / 10
+        self.main_window.path_spline_mode = self.spline_mode_combo.currentData()
+        self.main_window.path_curve_backend = self.curve_backend_combo.currentData()
 
         # スプラインマネージャーに適用
         self.main_window.drawing_area.spline_manager.hit_threshold = self.main_window.path_hit_threshold
@@ -399,12 +423,11 @@ class SettingsDialog(QDialog):
         self.main_window.handle_delete_mode_change(self.delete_mode_combo.currentText())
 
         # Undo/Redoスタックのリセット
-        self.main_window.drawing_area.undo_stack.clear()
-        self.main_window.drawing_area.redo_stack.clear()
+        self.main_window.drawing_area.clear_history()
 
         # パスツールの色と太さを更新
         if self.main_window.drawing_area.mode == 'spline':
-            for vp in self.main_window.drawing_area.spline_manager.selected_paths:
+            for vp in self.main_window.drawing_area.spline_manager.detach_selected_paths():
                 vp.pen_color = self.main_window.colors[self.main_window.current_color_index]
                 vp.pen_width = self.main_window.pen_size
                 vp.generate_path_from_bspline()
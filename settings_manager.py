@@ -1,7 +1,10 @@
 import os
 import yaml
 from PyQt5.QtGui import QColor
-from PyQt5.QtCore import QSize
+from PyQt5.QtCore import QSize, QTimer
+
+# 設定の変更からファイルへ書き出すまでの待ち時間（ミリ秒）。この間の変更はまとめて 1 回で書く
+SAVE_DELAY_MS = 2000
 
 
 class SettingsManager:
@@ -9,12 +12,17 @@ class SettingsManager:
         self.main_window = main_window
         self.settings = {}
         self.config_file = "config.yaml"
+        self.dirty = False
+        self.save_timer = QTimer()
+        self.save_timer.setSingleShot(True)
+        self.save_timer.setInterval(SAVE_DELAY_MS)
+        self.save_timer.timeout.connect(self.flush)
         self.load_settings()
 
     def load_settings(self):
         try:
             with open(self.config_file, 'r', encoding='utf-8') as f:
-                self.settings = yaml.safe_load(f) or {}
+                self.settings = yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader)) or {}
             self.main_window.key_config.update(
                 {k: self.main_window.key_name_to_code.get(v, v) for k, v in self.settings.get('key_config', {}).items()})
             self.main_window.mouse_config = self.deserialize_mouse_config(
@@ -34,8 +42,15 @@ class SettingsManager:
             self.main_window.default_simplify_tolerance = self.settings.get('default_simplify_tolerance', 1)
             self.main_window.default_smooth_strength = self.settings.get('default_smooth_strength', 1)
             self.main_window.path_hit_threshold = self.settings.get('path_hit_threshold', 2.0)
+            self.main_window.path_spline_mode = self.settings.get('path_spline_mode', 'interpolate')
+            self.main_window.path_curve_backend = self.settings.get('path_curve_backend', 'polyline')
+            self.main_window.path_bezier_tolerance = self.settings.get('path_bezier_tolerance', 0.5)
             self.main_window.delete_mode = self.settings.get('delete_mode', 'Delete Current Tool')
             self.main_window.stabilization_degree = self.settings.get('stabilization_degree', 0)
+            self.main_window.undo_memory_budget_mb = self.settings.get('undo_memory_budget_mb', 512)
+            self.main_window.undo_disk_budget_mb = self.settings.get('undo_disk_budget_mb', 2048)
+            self.main_window.image_prefetch_count = self.settings.get('image_prefetch_count', 2)
+            self.main_window.image_cache_mb = self.settings.get('image_cache_mb', 512)
             # 修飾キーの読み込み
             self.main_window.key_config.update(
                 {k: self.main_window.key_name_to_code.get(v, v) for k, v in self.settings.get('key_config', {}).items()})
@@ -43,6 +58,22 @@ class SettingsManager:
             print(f"Could not load settings: {e}")
 
     def save_settings(self):
+        # 変更済みの印を付けるだけで、書き出しは少し後（または終了時の flush）にまとめて行う
+        self.dirty = True
+        if not self.save_timer.isActive():
+            self.save_timer.start()
+
+    def flush(self):
+        self.save_timer.stop()
+        if not self.dirty:
+            return
+        self.dirty = False
+        try:
+            self.write_settings()
+        except OSError as e:
+            print(f"Could not save settings: {e}")
+
+    def write_settings(self):
         key_config_serialized = {k: self.main_window.code_to_key_name.get(v, str(v)) for k, v in self.main_window.key_config.items()}
         mouse_config_serialized = self.serialize_mouse_config(self.main_window.mouse_config)
         self.settings.update({
@@ -62,10 +93,22 @@ class SettingsManager:
             'default_simplify_tolerance': self.main_window.default_simplify_tolerance,
             'default_smooth_strength': self.main_window.default_smooth_strength,
             'path_hit_threshold': self.main_window.path_hit_threshold,
+            'path_spline_mode': self.main_window.path_spline_mode,
+            'path_curve_backend': self.main_window.path_curve_backend,
+            'path_bezier_tolerance': self.main_window.path_bezier_tolerance,
             'delete_mode': self.main_window.delete_mode,
+            'undo_memory_budget_mb': self.main_window.undo_memory_budget_mb,
+            'undo_disk_budget_mb': self.main_window.undo_disk_budget_mb,
+            'image_prefetch_count': self.main_window.image_prefetch_count,
+            'image_cache_mb': self.main_window.image_cache_mb,
         })
-        with open(self.config_file, 'w', encoding='utf-8') as f:
+        # 一時ファイルに書いてから置き換えるので、書き込み途中で落ちても元の設定は壊れない
+        temp_file = self.config_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
             yaml.safe_dump(self.settings, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.config_file)
 
     def serialize_mouse_config(self, mouse_config):
         serialized = {}
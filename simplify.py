@@ -0,0 +1,225 @@
+# simplify.py
+#
+# 折れ線の間引き。
+#   douglas_peucker     : 線分からの距離が tolerance 以下の点を落とす（shapely の simplify と同じ結果）
+#   visvalingam_whyatt  : 隣接 3 点の三角形面積が area_threshold 未満の点を落とす
+#   simplify_batch      : 複数の折れ線をまとめて間引く
+#
+# 間引きは NumPy で行う（Douglas–Peucker は全パスの区間を同時に分割していく）。
+# shapely は任意で、入っていれば長いパスの Douglas–Peucker だけを GEOS に任せる。
+
+import numpy as np
+
+# shapely（GEOS）は任意の高速化用。入っていれば、この点数以上のパスの Douglas–Peucker に使う。
+# これより短いパスは NumPy の方が速い（benchmarks/bench_simplify.py で測った分かれ目）
+ACCELERATE_MIN_POINTS = 40
+
+# shapely でまとめて間引く時に 1 回で渡す点数の目安
+BATCH_CHUNK_POINTS = 20000
+
+# load_shapely が import を試した結果（None: まだ、False: 入っていない）
+shapely_module = None
+
+
+def load_shapely():
+    # 起動を重くしないよう、長いパスを初めて間引く時に import する
+    global shapely_module
+    if shapely_module is None:
+        try:
+            import shapely
+        except ImportError:
+            shapely = False
+        shapely_module = shapely
+    return shapely_module or None
+
+
+def segment_distances(px, py, dx, dy):
+    # 線分 (0, 0)-(dx, dy) と点 (px, py) の距離。GEOS と同じ式で計算する
+    length_sq = dx * dx + dy * dy
+    safe_length_sq = np.where(length_sq > 0, length_sq, 1)
+    r = (px * dx + py * dy) / safe_length_sq
+    distances = np.abs((px * dy - py * dx) / safe_length_sq) * np.sqrt(length_sq)
+    to_start = (length_sq == 0) | (r <= 0)
+    to_end = (r >= 1) & ~to_start
+    distances = np.where(to_start, np.sqrt(px * px + py * py), distances)
+    qx, qy = px - dx, py - dy
+    return np.where(to_end, np.sqrt(qx * qx + qy * qy), distances)
+
+
+def douglas_peucker_mask(points, starts, ends, tolerance):
+    # points 中の区間 [starts[k], ends[k]] を同時に分割していき、残す点のマスクを返す。
+    # 区間の内側の点は座標ごと詰めて持ち、分割しない区間の点は次の段から外していく
+    x = np.ascontiguousarray(points[:, 0])
+    y = np.ascontiguousarray(points[:, 1])
+    keep = np.zeros(len(points), dtype=bool)
+    keep[starts] = True
+    keep[ends] = True
+    counts = ends - starts - 1
+    inner = counts > 0
+    starts, ends, counts = starts[inner], ends[inner], counts[inner]
+    if not len(starts):
+        return keep
+    first = np.cumsum(counts) - counts
+    index = np.arange(counts.sum()) + np.repeat(starts + 1 - first, counts)
+    px, py = x[index], y[index]
+    while len(index):
+        first = np.cumsum(counts) - counts
+        ax, ay = x[starts], y[starts]
+        dx, dy = x[ends] - ax, y[ends] - ay
+        length_sq = dx * dx + dy * dy
+        scale = np.sqrt(np.where(length_sq > 0, length_sq, 1))
+
+        # 区間内で比べるための値（距離 × 線分の長さ）。射影が線分の内側なら直線との外積の絶対値
+        sdx, sdy = np.repeat(dx, counts), np.repeat(dy, counts)
+        key = px * sdy
+        key -= py * sdx
+        key -= np.repeat(ax * dy - ay * dx, counts)
+        np.abs(key, out=key)
+        # 射影が線分の外（または長さ 0）の点は端点との距離で置き換える
+        dot = px * sdx
+        dot += py * sdy
+        dot -= np.repeat(ax * dx + ay * dy, counts)
+        slength_sq = np.repeat(length_sq, counts)
+        outside = np.flatnonzero((dot <= 0) | (dot >= slength_sq))
+        if len(outside):
+            segment = np.searchsorted(first, outside, side='right') - 1
+            near_start = dot[outside] <= 0
+            qx = px[outside] - np.where(near_start, ax[segment], ax[segment] + dx[segment])
+            qy = py[outside] - np.where(near_start, ay[segment], ay[segment] + dy[segment])
+            key[outside] = np.hypot(qx, qy) * scale[segment]
+
+        # 最大値に近い点だけ GEOS と同じ式で距離を測り直し、区間ごとに最初に最大となる点で分割する
+        # （式の違いによる丸め誤差で、同じ距離の点の選び方が GEOS とずれないように）
+        max_key = np.maximum.reduceat(key, first)
+        candidates = np.flatnonzero(key >= np.repeat(max_key * (1 - 1e-9), counts))
+        owner = np.searchsorted(first, candidates, side='right') - 1
+        distances = segment_distances(px[candidates] - ax[owner], py[candidates] - ay[owner],
+                                      dx[owner], dy[owner])
+        leading = np.ones(len(candidates), dtype=bool)
+        leading[1:] = owner[1:] != owner[:-1]
+        group = np.flatnonzero(leading)
+        max_distance = np.maximum.reduceat(distances, group)
+        is_max = np.flatnonzero(distances == max_distance[np.cumsum(leading) - 1])
+        first_max = np.ones(len(is_max), dtype=bool)
+        first_max[1:] = owner[is_max[1:]] != owner[is_max[:-1]]
+        pick = candidates[is_max[first_max]]
+        split = max_distance > tolerance
+        if not split.any():
+            break
+        split_index = index[pick[split]]
+        keep[split_index] = True
+
+        alive = np.repeat(split, counts)
+        alive[pick] = False
+        index, px, py = index[alive], px[alive], py[alive]
+        starts = np.column_stack((starts[split], split_index)).ravel()
+        ends = np.column_stack((split_index, ends[split])).ravel()
+        counts = ends - starts - 1
+        inner = counts > 0
+        starts, ends, counts = starts[inner], ends[inner], counts[inner]
+    return keep
+
+
+def visvalingam_whyatt_mask(points, starts, ends, area_threshold):
+    # 各区間の端点は残し、面積が閾値未満で両隣より小さい点（極小）をまとめて落とすのを繰り返す。
+    # 隣り合う点が同時に落ちることはないので、1 点ずつ落とす場合とほぼ同じ結果になる
+    x = np.ascontiguousarray(points[:, 0])
+    y = np.ascontiguousarray(points[:, 1])
+    keep = np.ones(len(points), dtype=bool)
+    fixed = np.zeros(len(points), dtype=bool)
+    fixed[starts] = True
+    fixed[ends] = True
+    alive = np.flatnonzero(keep)
+    while True:
+        xs, ys = x[alive], y[alive]
+        inner = np.flatnonzero(~fixed[alive[1:-1]]) + 1
+        area = np.full(len(alive), np.inf)
+        area[inner] = np.abs((xs[inner] - xs[inner - 1]) * (ys[inner + 1] - ys[inner - 1]) -
+                             (xs[inner + 1] - xs[inner - 1]) * (ys[inner] - ys[inner - 1])) / 2
+        remove = area < area_threshold
+        if not remove.any():
+            break
+        # 同じ面積が並んだ時は右端の 1 点だけが極小になる
+        remove[1:] &= area[1:] <= area[:-1]
+        remove[:-1] &= area[:-1] < area[1:]
+        keep[alive[remove]] = False
+        alive = alive[~remove]
+    return keep
+
+
+def douglas_peucker(points, tolerance):
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    if tolerance <= 0 or len(points) < 3:
+        return points
+    shapely = load_shapely() if len(points) >= ACCELERATE_MIN_POINTS else None
+    if shapely is not None:
+        return shapely.get_coordinates(shapely.simplify(shapely.linestrings(points), tolerance,
+                                                        preserve_topology=False))
+    keep = douglas_peucker_mask(points, np.array([0]), np.array([len(points) - 1]), tolerance)
+    return points[keep]
+
+
+def visvalingam_whyatt(points, area_threshold):
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    if area_threshold <= 0 or len(points) < 3:
+        return points
+    keep = visvalingam_whyatt_mask(points, np.array([0]), np.array([len(points) - 1]), area_threshold)
+    return points[keep]
+
+
+def simplify_with_shapely(shapely, paths, tolerance):
+    # 全パスの座標を一度に GEOS へ渡すとキャッシュに乗らず遅くなるので、点数で区切って処理する
+    result = []
+    chunk_start = 0
+    while chunk_start < len(paths):
+        chunk_end = chunk_start + 1
+        chunk_points = len(paths[chunk_start])
+        while chunk_end < len(paths) and chunk_points + len(paths[chunk_end]) <= BATCH_CHUNK_POINTS:
+            chunk_points += len(paths[chunk_end])
+            chunk_end += 1
+        chunk = paths[chunk_start:chunk_end]
+        lines = shapely.simplify([shapely.linestrings(points) for points in chunk], tolerance,
+                                 preserve_topology=False)
+        coords, owner = shapely.get_coordinates(lines, return_index=True)
+        counts = np.bincount(owner, minlength=len(chunk))
+        result.extend(np.split(coords, np.cumsum(counts)[:-1]))
+        chunk_start = chunk_end
+    return result
+
+
+def simplify_batch(paths, tolerance, method='douglas_peucker', backend=None):
+    # paths: (N_i, 2) 配列のリスト。入力と同じ順で間引いた配列を返す。
+    # backend は 'numpy' か 'shapely'。省略時は NumPy で処理し、shapely があれば
+    # ACCELERATE_MIN_POINTS 点以上のパスの Douglas–Peucker だけを任せる
+    paths = [np.asarray(points, dtype=float).reshape(-1, 2) for points in paths]
+    if method not in ('douglas_peucker', 'visvalingam_whyatt'):
+        raise ValueError(f"Unknown simplification method: {method}")
+    if tolerance <= 0 or not paths:
+        return paths
+
+    # 3 点未満のパスは間引けないのでそのまま返す
+    targets = [i for i, points in enumerate(paths) if len(points) >= 3]
+    result = list(paths)
+
+    if method == 'douglas_peucker' and backend != 'numpy':
+        shapely = load_shapely()
+        if shapely is None and backend == 'shapely':
+            raise ImportError("shapely is not installed")
+        if shapely is not None:
+            min_points = 3 if backend == 'shapely' else ACCELERATE_MIN_POINTS
+            accelerated = [i for i in targets if len(paths[i]) >= min_points]
+            for i, points in zip(accelerated, simplify_with_shapely(shapely, [paths[i] for i in accelerated],
+                                                                    tolerance)):
+                result[i] = points
+            targets = [i for i in targets if len(paths[i]) < min_points]
+    if not targets:
+        return result
+
+    lengths = np.array([len(paths[i]) for i in targets])
+    points = np.concatenate([paths[i] for i in targets])
+    offsets = np.cumsum(lengths) - lengths
+    mask = douglas_peucker_mask if method == 'douglas_peucker' else visvalingam_whyatt_mask
+    keep = mask(points, offsets, offsets + lengths - 1, tolerance)
+    for i, offset, length in zip(targets, offsets.tolist(), lengths.tolist()):
+        result[i] = points[offset:offset + length][keep[offset:offset + length]]
+    return result
@@ -0,0 +1,60 @@
+# spatial_index.py
+
+import math
+
+
+class UniformGrid:
+    # 矩形を一様グリッドのセルに登録し、点・矩形の近傍にある要素だけを返す
+    def __init__(self, cell_size=128):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.items = {}
+
+    def cell_range(self, x0, y0, x1, y1):
+        cs = self.cell_size
+        return (math.floor(x0 / cs), math.floor(y0 / cs),
+                math.floor(x1 / cs), math.floor(y1 / cs))
+
+    def insert(self, item, bounds):
+        if item in self.items:
+            self.remove(item)
+        cx0, cy0, cx1, cy1 = self.cell_range(*bounds)
+        self.items[item] = (bounds, (cx0, cy0, cx1, cy1))
+        for cy in range(cy0, cy1 + 1):
+            for cx in range(cx0, cx1 + 1):
+                self.cells.setdefault((cx, cy), set()).add(item)
+
+    def remove(self, item):
+        entry = self.items.pop(item, None)
+        if entry is None:
+            return
+        cx0, cy0, cx1, cy1 = entry[1]
+        for cy in range(cy0, cy1 + 1):
+            for cx in range(cx0, cx1 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell is not None:
+                    cell.discard(item)
+                    if not cell:
+                        del self.cells[(cx, cy)]
+
+    def clear(self):
+        self.cells.clear()
+        self.items.clear()
+
+    def query_rect(self, x0, y0, x1, y1):
+        cx0, cy0, cx1, cy1 = self.cell_range(x0, y0, x1, y1)
+        found = set()
+        for cy in range(cy0, cy1 + 1):
+            for cx in range(cx0, cx1 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell:
+                    found.update(cell)
+        result = []
+        for item in found:
+            bx0, by0, bx1, by1 = self.items[item][0]
+            if bx0 <= x1 and x0 <= bx1 and by0 <= y1 and y0 <= by1:
+                result.append(item)
+        return result
+
+    def query_point(self, x, y):
+        return self.query_rect(x, y, x, y)
@@ -1,13 +1,17 @@
 # spline_manager.py
 
 import math
-from PyQt5.QtCore import Qt, QPointF
+from PyQt5.QtCore import Qt, QPointF, QRectF
+from PyQt5.QtGui import QTransform
 from PyQt5.QtWidgets import QApplication
-from vector_path import VectorPath
+from path_document import PathDocument
+from stroke_renderer import StrokeRenderer
+from spatial_index import UniformGrid
+from path_finalizer import PathFinalizer
 
 
 class SplineManager:
-    def __init__(self, drawing_area, control_point_size=10, scaling_sensitivity=0.002, hit_threshold=2.0):
+    def __init__(self, drawing_area, control_point_size=10, hit_threshold=2.0):
         self.drawing_area = drawing_area
         self.paths = []
         self.selected_paths = []
@@ -16,7 +20,6 @@ class SplineManager:
         self.is_drawing = False
         self.current_scribble_points = []
         self.control_point_size = control_point_size
-        self.scaling_sensitivity = scaling_sensitivity
 
         self.mode = 'drawing'  # <-- モードの追加
 
@@ -26,6 +29,8 @@ class SplineManager:
         self.scaling_start_pos = None
         self.scaling_mode = None
         self.proportional_scaling = True
+        self.scaling_pivot = None
+        self.scaling_base_transforms = {}
 
         self.is_moving = False
         self.is_moving_control_point = False
@@ -41,21 +46,145 @@ class SplineManager:
         self.default_fill_enabled = False
         self.freehand_path = None
 
+        # スナップショットを取るたびに進む世代。これより古い世代のパスは履歴と共有されている
+        self.generation = 0
+
+        # 描画中パスのプレビューもフレーム単位でまとめて更新する
+        self.path_renderer = StrokeRenderer(self.flush_path_samples)
+
+        # クリック判定用の空間インデックス（パスの外接矩形と制御点）
+        self.path_index = UniformGrid(cell_size=128)
+        self.control_point_index = UniformGrid(cell_size=32)
+        self.control_point_counts = {}
+
+        # マウスリリース時の確定処理はワーカーで行い、結果は該当パスにその場で反映する
+        self.path_finalizer = PathFinalizer()
+        self.path_finalizer.finished.connect(self.on_path_finalized)
+
     def notify_change(self):
         if self.on_change:
             self.on_change()
         self.drawing_area.update()
 
+    def snapshot(self):
+        document = PathDocument.capture(self.paths, self.selected_paths)
+        self.generation += 1
+        return document
+
+    def restore(self, document):
+        self.deselect_all_paths()
+        old_paths = set(self.paths)
+        new_paths = set(document.paths)
+        for path in old_paths - new_paths:
+            self.unindex_path(path)
+        for path in new_paths - old_paths:
+            self.index_path(path)
+        self.paths = list(document.paths)
+        self.selected_paths = document.selected_paths()
+        for path in self.selected_paths:
+            path.selected = True
+        for path in self.paths:
+            path.drawing_area = self.drawing_area
+        self.selected_control_point = None
+        self.is_moving_control_point = False
+        self.is_moving_path = False
+
+    def detach_path(self, path):
+        # 履歴と共有しているパスは変更前にコピーする（コピーオンライト）
+        if path.generation == self.generation:
+            return path
+        new_path = path.copy()
+        new_path.generation = self.generation
+        new_path.selected = path.selected
+        self.paths[self.paths.index(path)] = new_path
+        self.unindex_path(path)
+        self.index_path(new_path)
+        if path in self.selected_paths:
+            self.selected_paths[self.selected_paths.index(path)] = new_path
+        return new_path
+
+    def detach_selected_paths(self):
+        for path in list(self.selected_paths):
+            self.detach_path(path)
+        return self.selected_paths
+
+    def begin_edit(self):
+        self.drawing_area.push_undo_stack()
+        return self.detach_selected_paths()
+
     def delete_selected_paths(self):
         if self.selected_paths:
+            self.drawing_area.push_undo_stack()
             for path in self.selected_paths:
                 if path in self.paths:
                     self.paths.remove(path)
+                    self.unindex_path(path)
             self.selected_paths.clear()
-            self.drawing_area.push_undo_stack()
             self.drawing_area.update_vector_layer()
             self.drawing_area.update()
 
+    def clear_paths(self):
+        self.paths.clear()
+        self.selected_paths.clear()
+        self.path_index.clear()
+        self.control_point_index.clear()
+        self.control_point_counts.clear()
+
+    def index_path(self, path):
+        if path.pending:
+            return
+        rect = path.bounds()
+        self.path_index.insert(path, (rect.left(), rect.top(), rect.right(), rect.bottom()))
+        half = self.control_point_size / 2
+        points = path.transformed_control_points().tolist()
+        for index, (x, y) in enumerate(points):
+            self.control_point_index.insert((path, index), (x - half, y - half, x + half, y + half))
+        for index in range(len(points), self.control_point_counts.get(path, 0)):
+            self.control_point_index.remove((path, index))
+        self.control_point_counts[path] = len(points)
+
+    def unindex_path(self, path):
+        self.path_index.remove(path)
+        for index in range(self.control_point_counts.pop(path, 0)):
+            self.control_point_index.remove((path, index))
+
+    def reindex_paths(self, paths):
+        for path in paths:
+            if path in self.control_point_counts:
+                self.index_path(path)
+
+    def preload_modules(self):
+        self.path_finalizer.preload('vector_path', 'scipy.interpolate')
+
+    def reprocess_paths(self, paths, tolerance, strength):
+        from simplify import simplify_batch
+        # キャッシュにない形状が必要なパスは、間引きだけ全パス分まとめて計算する
+        misses = [path for path in paths if path.needs_processing(tolerance, strength)]
+        simplified = dict(zip(misses, simplify_batch([path.processing_source() for path in misses], tolerance)))
+        for path in paths:
+            path.set_processing(tolerance, strength, simplified.get(path))
+        self.reindex_paths(paths)
+
+    def topmost(self, paths):
+        # z順（paths の後ろほど手前）で並べる
+        return sorted(paths, key=self.paths.index, reverse=True)
+
+    def control_point_at(self, pos):
+        hits = self.control_point_index.query_point(pos.x(), pos.y())
+        for path in self.topmost({path for path, _ in hits}):
+            index = path.get_control_point_at(pos, self.control_point_size)
+            if index is not None:
+                return path, index
+        return None, None
+
+    def path_at(self, pos):
+        margin = self.hit_threshold
+        hits = self.path_index.query_rect(pos.x() - margin, pos.y() - margin, pos.x() + margin, pos.y() + margin)
+        for path in self.topmost(hits):
+            if path.contains_point(pos, self.hit_threshold):
+                return path
+        return None
+
     def handle_mouse_press(self, event):
         pos = self.drawing_area.get_image_coordinates(event.pos())
         modifiers = QApplication.keyboardModifiers()
@@ -63,27 +192,29 @@ class SplineManager:
         if event.button() == Qt.LeftButton:
             if self.mode == 'selection':
                 # 選択モードの処理
-                for path in reversed(self.paths):
-                    index = path.get_control_point_at(pos, self.control_point_size)
-                    if index is not None:
-                        self.deselect_all_paths()
-                        self.selected_paths = [path]
-                        path.selected = True
-                        self.selected_control_point = (path, index)
-                        self.is_moving_control_point = True
-                        self.drawing_area.push_undo_stack()
-                        self.drawing_area.update()
-                        return
+                if self.begin_transform(pos, modifiers):
+                    return
 
-                for path in reversed(self.paths):
-                    if path.contains_point(pos, self.hit_threshold):
-                        self.deselect_all_paths()
-                        self.selected_paths = [path]
-                        path.selected = True
-                        self.is_moving_path = True
-                        self.drawing_area.push_undo_stack()
-                        self.drawing_area.update()
-                        return
+                path, index = self.control_point_at(pos)
+                if path is not None:
+                    self.deselect_all_paths()
+                    self.selected_paths = [path]
+                    path.selected = True
+                    path = self.begin_edit()[0]
+                    self.selected_control_point = (path, index)
+                    self.is_moving_control_point = True
+                    self.drawing_area.update()
+                    return
+
+                path = self.path_at(pos)
+                if path is not None:
+                    self.deselect_all_paths()
+                    self.selected_paths = [path]
+                    path.selected = True
+                    self.is_moving_path = True
+                    self.begin_edit()
+                    self.drawing_area.update()
+                    return
 
                 if self.selected_paths:
                     clicked_inside_selection_rect = False
@@ -93,7 +224,7 @@ class SplineManager:
                             break
                     if clicked_inside_selection_rect:
                         self.is_moving_path = True
-                        self.drawing_area.push_undo_stack()
+                        self.begin_edit()
                         self.drawing_area.update()
                         return
                     else:
@@ -102,6 +233,7 @@ class SplineManager:
                         return
             elif self.mode == 'drawing':
                 # 描画モードの処理
+                from vector_path import VectorPath
                 self.current_path = VectorPath(self.drawing_area)
                 self.current_path.pen_color = self.drawing_area.colors[self.drawing_area.current_color_index]
                 self.current_path.pen_width = self.drawing_area.pen_size
@@ -189,25 +321,30 @@ class SplineManager:
 
         if self.mode == 'drawing':
             if self.is_drawing and self.current_path is not None:
-                self.current_path.add_point(pos)
-                self.drawing_area.update_vector_layer()
-                self.drawing_area.update()
+                self.path_renderer.add_sample(pos, self.current_path.pen_width)
                 self.last_mouse_pos = pos
                 return
         elif self.mode == 'selection':
+            if self.is_scaling:
+                dirty_rect = self.active_paths_rect()
+                self.update_transform(pos)
+                self.drawing_area.update_active_paths(dirty_rect.united(self.active_paths_rect()))
+                self.last_mouse_pos = pos
+                return
+
             if self.is_moving_control_point and self.selected_control_point:
                 path, index = self.selected_control_point
+                dirty_rect = path.visual_rect(self.control_point_size)
                 path.move_control_point(index, delta)
-                self.drawing_area.update_vector_layer()
-                self.drawing_area.update()
+                self.drawing_area.update_active_paths(dirty_rect.united(path.visual_rect(self.control_point_size)))
                 self.last_mouse_pos = pos
                 return
 
             if self.is_moving_path and self.selected_paths:
+                dirty_rect = self.active_paths_rect()
                 for path in self.selected_paths:
                     path.move_by(delta)
-                self.drawing_area.update_vector_layer()
-                self.drawing_area.update()
+                self.drawing_area.update_active_paths(dirty_rect.united(self.active_paths_rect()))
                 self.last_mouse_pos = pos
                 return
 
@@ -218,15 +355,26 @@ class SplineManager:
         if event.button() == Qt.LeftButton:
             if self.mode == 'drawing':
                 if self.is_drawing:
+                    self.path_renderer.flush()
                     if self.current_path:
-                        self.current_path.finalize()
-                        self.paths.append(self.current_path)
-                        self.current_path = None
+                        path = self.current_path
                         self.drawing_area.push_undo_stack()
+                        path.generation = self.generation
+                        path.pending = True
+                        self.paths.append(path)
+                        self.current_path = None
+                        self.path_finalizer.submit(path, path.finalize_points, *path.finalize_args())
                         self.drawing_area.update_vector_layer()
                         self.drawing_area.update()
                     self.is_drawing = False
             elif self.mode == 'selection':
+                committed = self.is_moving_control_point or self.is_moving_path or self.is_scaling
+                if self.is_scaling:
+                    self.is_scaling = False
+                    self.scaling_mode = None
+                    self.scaling_start_pos = None
+                    self.scaling_pivot = None
+                    self.scaling_base_transforms = {}
                 if self.is_moving_control_point:
                     self.is_moving_control_point = False
                     self.selected_control_point = None
@@ -234,31 +382,141 @@ class SplineManager:
                 if self.is_moving_path:
                     self.is_moving_path = False
 
+                if committed:
+                    for path in self.selected_paths:
+                        path.commit_edit()
+                    self.reindex_paths(self.selected_paths)
+                    self.drawing_area.update_vector_layer()
+                    self.drawing_area.update()
+
+    def begin_transform(self, pos, modifiers):
+        # 選択枠の角のハンドルを掴んだら拡大縮小（回転修飾キーなら回転）を始める
+        for path in self.topmost(self.selected_paths):
+            handle = path.handle_at(pos)
+            if handle is not None:
+                break
+        else:
+            return False
+
+        bounds = QRectF()
+        for path in self.selected_paths:
+            bounds = bounds.united(path.bounds())
+        if modifiers & self.rotate_modifier:
+            self.scaling_mode = 'rotate'
+            self.scaling_pivot = bounds.center()
+        else:
+            self.scaling_mode = 'scale'
+            corners = [bounds.topLeft(), bounds.topRight(), bounds.bottomLeft(), bounds.bottomRight()]
+            self.scaling_pivot = corners[3 - handle]
+            self.proportional_scaling = not modifiers & self.scale_modifier
+
+        self.begin_edit()
+        self.scaling_base_transforms = {path: QTransform(path.transform) for path in self.selected_paths}
+        self.scaling_start_pos = pos
+        self.is_scaling = True
+        self.drawing_area.update()
+        return True
+
+    def update_transform(self, pos):
+        # ドラッグ中は各パスの変換を差し替えるだけ。制御点は離した時に一度だけ計算する
+        pivot = self.scaling_pivot
+        start = self.scaling_start_pos - pivot
+        current = pos - pivot
+        transform = QTransform()
+        if self.scaling_mode == 'rotate':
+            angle = math.atan2(current.y(), current.x()) - math.atan2(start.y(), start.x())
+            transform.rotate(math.degrees(angle))
+        elif self.proportional_scaling:
+            factor = self.scale_factor(math.hypot(start.x(), start.y()),
+                                       math.hypot(current.x(), current.y()))
+            transform.scale(factor, factor)
+        else:
+            transform.scale(self.scale_factor(start.x(), current.x()), self.scale_factor(start.y(), current.y()))
+        transform = (QTransform.fromTranslate(-pivot.x(), -pivot.y()) * transform *
+                     QTransform.fromTranslate(pivot.x(), pivot.y()))
+        for path in self.selected_paths:
+            path.transform = self.scaling_base_transforms.get(path, QTransform()) * transform
+
+    def scale_factor(self, start, current):
+        # 基準点からの距離の比。ハンドルが基準点を越えても反転はさせず、
+        # 基準点からハンドル 1 つ分より近くには縮めない（制御点が 1 点に潰れないように）
+        if start == 0:
+            return 1.0
+        factor = current / start
+        minimum = min(1.0, self.control_point_size / abs(start))
+        return max(factor, minimum)
+
+    def on_path_finalized(self, path, future):
+        future = self.path_finalizer.take(path)
+        if future is None:
+            return
+        self.apply_finalized_path(path, future)
+        self.drawing_area.update_vector_layer()
+        self.drawing_area.update()
+
+    def apply_finalized_path(self, path, future):
+        # 履歴のスナップショットとも共有しているオブジェクトなので、その場で書き換えれば
+        # Undo/Redo のどちらの状態にも確定後の形が反映される
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Failed to finalize path: {e}")
+            result = (path.raw_points, None, None)
+        path.apply_finalized(result)
+        if path in self.paths:
+            self.index_path(path)
+
+    def finish_pending_paths(self):
+        # 保存前などに、確定待ちのパスをすべて待って反映する
+        tokens = self.path_finalizer.pending_tokens()
+        for path in tokens:
+            self.apply_finalized_path(path, self.path_finalizer.take(path))
+        if tokens:
+            self.drawing_area.update_vector_layer()
+
+    def flush_path_samples(self, samples, brush=None):
+        if not self.is_drawing or self.current_path is None:
+            return
+        # 末尾の点は間引きで置き換わることがあるので、その手前の確定点から再描画する
+        points = self.current_path.points
+        last_point = points[-2] if len(points) >= 2 else (points[-1] if points else None)
+        # 塗りつぶしは始点と終点を結んだ形で描かれるので、点を足すとパス全体の見た目が変わる
+        before = self.current_path.visual_rect() if self.current_path.fill_enabled else None
+        for point, _ in samples:
+            self.current_path.add_point(point)
+        dirty_rect = StrokeRenderer.samples_rect(last_point, samples)
+        if before is not None:
+            dirty_rect = dirty_rect.united(before).united(self.current_path.visual_rect())
+        dirty_rect = dirty_rect.toAlignedRect()
+        self.drawing_area.update(self.drawing_area.image_rect_to_widget(dirty_rect))
+
     def deselect_all_paths(self):
         for path in self.paths:
             path.selected = False
         self.selected_paths = []
+        # 選択中のパスは静的レイヤーから外れるので作り直す
+        self.drawing_area.update_vector_layer()
+
+    def active_paths_rect(self):
+        rect = QRectF()
+        for path in self.selected_paths:
+            rect = rect.united(path.visual_rect(self.control_point_size))
+        return rect
 
-    def draw_paths(self, painter):
+    def draw_paths(self, painter, clip_rect=None):
+        self.draw_static_paths(painter, clip_rect)
+        self.draw_active_paths(painter, clip_rect)
+
+    def draw_static_paths(self, painter, clip_rect=None):
         for vp in self.paths:
-            vp.draw(painter, self.control_point_size)
+            if vp.selected:
+                continue
+            if clip_rect is None or vp.visual_rect(self.control_point_size).intersects(clip_rect):
+                vp.draw(painter, self.control_point_size)
+
+    def draw_active_paths(self, painter, clip_rect=None):
+        for vp in self.selected_paths:
+            if clip_rect is None or vp.visual_rect(self.control_point_size).intersects(clip_rect):
+                vp.draw(painter, self.control_point_size)
         if self.is_drawing and self.current_path:
             self.current_path.draw(painter, self.control_point_size)
-
-    def copy(self):
-        new_manager = SplineManager(self.drawing_area)
-        new_manager.paths = [path.copy() for path in self.paths]
-        new_manager.selected_paths = []
-        for path in self.selected_paths:
-            index = self.paths.index(path)
-            new_manager.selected_paths.append(new_manager.paths[index])
-            new_manager.paths[index].selected = True
-        new_manager.current_path = self.current_path.copy() if self.current_path else None
-        new_manager.is_drawing = self.is_drawing
-        new_manager.is_moving_control_point = self.is_moving_control_point
-        new_manager.is_moving_path = self.is_moving_path
-        new_manager.hit_threshold = self.hit_threshold
-        new_manager.control_point_size = self.control_point_size
-        new_manager.last_mouse_pos = self.last_mouse_pos
-        new_manager.default_fill_enabled = self.default_fill_enabled
-        return new_manager
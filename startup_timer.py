@@ -0,0 +1,29 @@
+# startup_timer.py
+
+import sys
+import time
+
+
+class StartupTimer:
+    # 起動の各段階にかかった時間を記録する。--startup-report 付きで起動すると表示する
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.phases = []
+        self.enabled = '--startup-report' in sys.argv
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def report(self):
+        if not self.enabled:
+            return
+        print("Startup time breakdown:")
+        for name, elapsed in self.phases:
+            print(f"  {name:<24s} {elapsed * 1000:8.1f} ms")
+        print(f"  {'total':<24s} {(self.last - self.start) * 1000:8.1f} ms")
+
+
+startup_timer = StartupTimer()
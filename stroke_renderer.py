@@ -0,0 +1,83 @@
+# stroke_renderer.py
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QPen, QPolygonF
+from PyQt5.QtCore import Qt, QTimer, QPointF
+
+DEFAULT_FRAME_INTERVAL_MS = 16
+# 筆圧によるペン幅は 0.5px 単位に丸め、同じ幅の区間をまとめて描けるようにする
+PEN_WIDTH_STEP = 0.5
+
+
+def frame_interval_ms():
+    screen = QApplication.primaryScreen() if QApplication.instance() else None
+    if screen is not None and screen.refreshRate() > 0:
+        return max(1, int(1000 / screen.refreshRate()))
+    return DEFAULT_FRAME_INTERVAL_MS
+
+
+class StrokeRenderer:
+    # 入力サンプルをためておき、表示フレームごとに一度だけ flush_callback(samples, brush) に渡す。
+    # brush（色や消しゴムなど）は入力した時点のもので、途中で変わったらそこまでの分を先に渡す
+    def __init__(self, flush_callback, interval_ms=None):
+        self.flush_callback = flush_callback
+        self.samples = []
+        self.brush = None
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval_ms if interval_ms is not None else frame_interval_ms())
+        self.timer.timeout.connect(self.flush)
+
+    def add_sample(self, point, pen_size=None, brush=None):
+        if pen_size is not None:
+            pen_size = max(PEN_WIDTH_STEP, round(pen_size / PEN_WIDTH_STEP) * PEN_WIDTH_STEP)
+        if self.samples and brush != self.brush:
+            self.flush()
+        self.brush = brush
+        self.samples.append((point, pen_size))
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        self.timer.stop()
+        if not self.samples:
+            return
+        samples = self.samples
+        self.samples = []
+        self.flush_callback(samples, self.brush)
+
+    def discard(self):
+        self.timer.stop()
+        self.samples = []
+
+    @staticmethod
+    def samples_rect(start, samples):
+        points = [QPointF(point) for point, _ in samples]
+        if start is not None:
+            points.insert(0, QPointF(start))
+        margin = max(pen_size for _, pen_size in samples) / 2 + 2
+        return QPolygonF(points).boundingRect().adjusted(-margin, -margin, margin, margin)
+
+    @staticmethod
+    def draw_samples(painter, color, start, samples):
+        # ペン幅が変わらない区間は1本のポリラインとしてまとめて描く
+        pen = QPen(color, 1, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin)
+        index = 0
+        if start is None:
+            point, pen_size = samples[0]
+            pen.setWidthF(pen_size)
+            painter.setPen(pen)
+            painter.drawPoint(point)
+            start = point
+            index = 1
+        while index < len(samples):
+            pen_size = samples[index][1]
+            polyline = [QPointF(start)]
+            while index < len(samples) and samples[index][1] == pen_size:
+                polyline.append(QPointF(samples[index][0]))
+                index += 1
+            pen.setWidthF(pen_size)
+            painter.setPen(pen)
+            painter.drawPolyline(QPolygonF(polyline))
+            start = samples[index - 1][0]
+        return start
@@ -0,0 +1,222 @@
+# undo_history.py
+
+import sys
+import tempfile
+
+MEGABYTE = 1024 * 1024
+COMPACT_THRESHOLD = 64 * MEGABYTE
+
+
+class SpillFile:
+    # 圧縮済みの履歴エントリを追記していく一時ファイル
+    def __init__(self):
+        self.file = None
+        self.live_bytes = 0
+        self.dead_bytes = 0
+
+    def write(self, data):
+        if self.file is None:
+            self.file = tempfile.TemporaryFile(prefix='sketchrush_undo_')
+        self.file.seek(0, 2)
+        offset = self.file.tell()
+        self.file.write(data)
+        self.live_bytes += len(data)
+        return offset, len(data)
+
+    def read(self, record):
+        offset, length = record
+        self.file.seek(offset)
+        return self.file.read(length)
+
+    def discard(self, record):
+        self.live_bytes -= record[1]
+        self.dead_bytes += record[1]
+        if self.live_bytes == 0:
+            self.reset()
+
+    def needs_compaction(self):
+        return self.dead_bytes > COMPACT_THRESHOLD and self.dead_bytes > self.live_bytes
+
+    def reset(self):
+        if self.file is not None:
+            self.file.seek(0)
+            self.file.truncate()
+        self.live_bytes = 0
+        self.dead_bytes = 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.live_bytes = 0
+        self.dead_bytes = 0
+
+
+class UndoHistory:
+    def __init__(self, memory_budget_mb=512, disk_budget_mb=2048):
+        self.undo_stack = []
+        self.redo_stack = []
+        self.spill_file = SpillFile()
+        self.memory_budget = 0
+        self.disk_budget = 0
+        # 履歴が保持しているメモリ量の合計。エントリの出し入れのたびに増減させる
+        self.resident_bytes = 0
+        # 履歴内のパスごとの [参照しているエントリ数, バイト数]。スナップショット間で共有される
+        # パスは 1 度だけ数え、最後に参照していたエントリが消えた時に差し引く
+        self.path_refs = {}
+        self.set_budget(memory_budget_mb, disk_budget_mb)
+
+    def set_budget(self, memory_budget_mb, disk_budget_mb):
+        self.memory_budget = int(memory_budget_mb * MEGABYTE)
+        self.disk_budget = int(disk_budget_mb * MEGABYTE)
+        self.enforce_budget()
+
+    @staticmethod
+    def raster_size(entry):
+        size = sys.getsizeof(entry)
+        raster = entry.get('raster')
+        if raster is not None:
+            size += raster.nbytes()
+        return size
+
+    def add_entry(self, entry):
+        # エントリ固有の分（ラスターの差分）は entry['resident'] に覚えておく。
+        # キーを足すと dict 自体の大きさが変わるので、先にキーを作ってから測る
+        entry['resident'] = 0
+        entry['resident'] = self.raster_size(entry)
+        self.resident_bytes += entry['resident']
+        paths = entry.get('paths')
+        for path in paths.paths if paths is not None else ():
+            ref = self.path_refs.get(id(path))
+            if ref is None:
+                ref = self.path_refs[id(path)] = [0, path.nbytes()]
+                self.resident_bytes += ref[1]
+            ref[0] += 1
+
+    def remove_entry(self, entry):
+        self.resident_bytes -= entry.pop('resident')
+        paths = entry.get('paths')
+        for path in paths.paths if paths is not None else ():
+            ref = self.path_refs[id(path)]
+            ref[0] -= 1
+            if ref[0] == 0:
+                self.resident_bytes -= ref[1]
+                del self.path_refs[id(path)]
+
+    def refresh_entry(self, entry):
+        # 描画中のストロークの差分は push 後も大きくなるので測り直す
+        size = self.raster_size(entry)
+        self.resident_bytes += size - entry['resident']
+        entry['resident'] = size
+
+    def push(self, entry):
+        self.add_entry(entry)
+        self.undo_stack.append(entry)
+        for dropped in self.redo_stack:
+            self.remove_entry(dropped)
+            self.release_entry(dropped)
+        self.redo_stack.clear()
+        self.enforce_budget()
+
+    def append_undo(self, entry):
+        self.add_entry(entry)
+        self.undo_stack.append(entry)
+        self.enforce_budget()
+
+    def append_redo(self, entry):
+        self.add_entry(entry)
+        self.redo_stack.append(entry)
+        self.enforce_budget()
+
+    def pop_undo(self):
+        if not self.undo_stack:
+            return None
+        return self.take_entry(self.undo_stack.pop())
+
+    def pop_redo(self):
+        if not self.redo_stack:
+            return None
+        return self.take_entry(self.redo_stack.pop())
+
+    def take_entry(self, entry):
+        self.remove_entry(entry)
+        return self.load_entry(entry)
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.resident_bytes = 0
+        self.path_refs.clear()
+        self.spill_file.reset()
+
+    def close(self):
+        self.clear()
+        self.spill_file.close()
+
+    def load_entry(self, entry):
+        raster = entry.get('raster')
+        if raster is not None and raster.is_spilled():
+            record = raster.spill_record
+            raster.restore_dump(self.spill_file.read(record))
+            self.spill_file.discard(record)
+            self.compact()
+        return entry
+
+    def release_entry(self, entry):
+        raster = entry.get('raster')
+        if raster is not None and raster.is_spilled():
+            self.spill_file.discard(raster.spill_record)
+            self.compact()
+
+    def compact(self):
+        # 読み戻し・破棄で空いた領域が溜まったら生きているレコードだけを新しいファイルへ移す
+        if not self.spill_file.needs_compaction():
+            return
+        new_file = SpillFile()
+        for entry in self.undo_stack + self.redo_stack:
+            raster = entry.get('raster')
+            if raster is not None and raster.is_spilled():
+                raster.spill_record = new_file.write(self.spill_file.read(raster.spill_record))
+        self.spill_file.close()
+        self.spill_file = new_file
+
+    def spill_entry(self, entry):
+        raster = entry.get('raster')
+        if raster is None or raster.is_spilled() or not raster.committed or raster.is_empty():
+            return
+        resident = raster.nbytes()
+        raster.release(self.spill_file.write(raster.dump()))
+        entry['resident'] -= resident
+        self.resident_bytes -= resident
+
+    def spill_candidates(self):
+        # 古いものから退避する。Redo 側は現在位置から遠いものを先に
+        yield from self.undo_stack[:-1]
+        yield from self.redo_stack[:-1]
+
+    def enforce_budget(self):
+        if self.undo_stack:
+            self.refresh_entry(self.undo_stack[-1])
+        if self.resident_bytes > self.memory_budget:
+            for entry in self.spill_candidates():
+                self.spill_entry(entry)
+                if self.resident_bytes <= self.memory_budget:
+                    break
+
+        while self.spill_file.live_bytes > self.disk_budget and len(self.undo_stack) + len(self.redo_stack) > 1:
+            self.drop_oldest()
+
+        # 直近のエントリのラスター差分は退避しないので予算判定から除く。残りの退避できない分
+        # （パスのスナップショット等）が予算を超える場合は古い履歴を捨てる
+        while len(self.undo_stack) > 1:
+            protected = sum(stack[-1]['resident'] for stack in (self.undo_stack, self.redo_stack) if stack)
+            if self.resident_bytes - protected <= self.memory_budget:
+                break
+            self.drop_oldest()
+
+    def drop_oldest(self):
+        stack = self.undo_stack if self.undo_stack else self.redo_stack
+        if stack:
+            entry = stack.pop(0)
+            self.remove_entry(entry)
+            self.release_entry(entry)
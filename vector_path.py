@@ -2,15 +2,49 @@
 
 import math
 import numpy as np
-from scipy.interpolate import splprep, splev
-from shapely.geometry import LineString
-from PyQt5.QtGui import QPainterPath, QPainter, QPen, QColor, QBrush, QPainterPathStroker
+from PyQt5.QtGui import QPainterPath, QPainter, QPen, QColor, QBrush, QPainterPathStroker, QTransform
 from PyQt5.QtCore import QPointF, QRectF, Qt
+from simplify import douglas_peucker
+from bezier_fit import fit_beziers
+
+# B スプラインのサンプル数は弧長と曲がり具合から決める
+SAMPLE_SPACING = 4.0
+SAMPLE_ANGLE_STEP = math.radians(6)
+MIN_SAMPLES = 8
+MAX_SAMPLES = 400
+
+# 'interpolate': scipy の補間スプライン（大域的）、'catmull_rom': 局所サポートの Catmull-Rom 曲線
+SPLINE_MODES = ('interpolate', 'catmull_rom')
+
+# 'polyline': スプラインのサンプル点を lineTo で結ぶ、'bezier': 誤差以内の 3 次ベジェ列で近似する
+CURVE_BACKENDS = ('polyline', 'bezier')
+
+SELECTION_HANDLE_SIZE = 10
+
+# 入力中の逐次間引き。直前の確定点からの線分に対してこの距離以内に収まる点は置き換えていく
+STREAM_TOLERANCE = 0.5
+STREAM_LOOKBACK = 32
+
+# (間引き許容値, 平滑化強度) ごとに保持する派生形状の数
+DERIVED_CACHE_SIZE = 16
+
+# 履歴のメモリ量の見積もりに使う値。QPainterPath の要素は座標 2 つと種類で 24 バイト、
+# それ以外（オブジェクト本体・色・変換など）は 1 本あたりの概算
+PATH_ELEMENT_BYTES = 24
+PATH_OVERHEAD_BYTES = 1024
+
+
+def transform_points(transform, points):
+    # QTransform のアフィン部分を (N, 2) 配列に適用する
+    matrix = np.array(((transform.m11(), transform.m12()), (transform.m21(), transform.m22())))
+    return points @ matrix + (transform.dx(), transform.dy())
 
 
 class VectorPath:
     def __init__(self, drawing_area):
         self.points = []
+        # 末尾の点に置き換えられたり、近すぎて捨てたりした生サンプル（直前の確定点より後ろのもの）
+        self.stream_window = []
         self.drawing_area = drawing_area
         self.control_points = []
         self.qt_path = QPainterPath()
@@ -18,38 +52,174 @@ class VectorPath:
         self.pen_width = drawing_area.pen_size
         self.fill_color = QColor(255, 255, 255)
         self.fill_enabled = False
-        self.spline_control_points = []
+        # 制御点は (N, 2) の float64 配列で保持する。spline_control_points は読み取り専用のタプル（変更は代入か control_point_array で行う）
+        self.spline_fit = None
+        self.control_point_array = np.empty((0, 2))
         self.path = QPainterPath()
         self.selected = False
         self.is_closed = False
+        self.spline_mode = drawing_area.main_window.path_spline_mode
+        self.curve_backend = drawing_area.main_window.path_curve_backend
+        self.bezier_tolerance = drawing_area.main_window.path_bezier_tolerance
+        # (サンプル点, ベジェ列)。サンプル点の配列が同じものである間は使い回す
+        self.bezier_cache = None
+        # 制御点のドラッグ中は折れ線で表示し、確定時にベジェへ当てはめ直す
+        self.preview_geometry = False
+        # 移動中のアフィン変換。描画・書き出し時に適用し、確定時に制御点へ焼き込む
+        self.transform = QTransform()
+        self.generation = 0
+        # ワーカーで確定処理中のパス。結果が届くまで生の折れ線を表示し、選択対象にしない
+        self.pending = False
+        # 間引き・平滑化前の点。None の時は現在の制御点がそのまま元データ
+        self.raw_points = None
+        self.simplify_tolerance = 0
+        self.smooth_strength = 0
+        self.derived_cache = {}
+        # 当たり判定用のアウトライン（幅ごと）。形状が変わるたびに version を進めて破棄する
+        self.geometry_version = 0
+        self.outline_cache = {}
+
+    @property
+    def spline_control_points(self):
+        return tuple(tuple(point) for point in self.control_point_array.tolist())
+
+    @spline_control_points.setter
+    def spline_control_points(self, points):
+        self.control_point_array = np.array(points, dtype=float).reshape(-1, 2)
+
+    @property
+    def control_point_array(self):
+        return self._control_point_array
+
+    @control_point_array.setter
+    def control_point_array(self, points):
+        self._control_point_array = points
+        self.spline_fit = None
 
     def add_point(self, point):
-        self.points.append(point)
-        if len(self.points) == 1:
+        x, y = point.x(), point.y()
+        if not self.points:
+            self.points.append(QPointF(point))
             self.path.moveTo(point)
-        else:
-            self.path.lineTo(point)
+            self.invalidate_geometry()
+            return
 
-    def generate_path_from_bspline(self):
-        if len(self.spline_control_points) < 2:
+        last = self.points[-1]
+        if math.hypot(x - last.x(), y - last.y()) <= STREAM_TOLERANCE:
+            # 末尾の点が後で置き換えられた時にも確かめられるよう、捨てたサンプルも窓に残す
+            if len(self.stream_window) < STREAM_LOOKBACK:
+                self.stream_window.append((x, y))
+            return
+
+        if len(self.points) >= 2 and len(self.stream_window) < STREAM_LOOKBACK:
+            anchor = self.points[-2]
+            window = self.stream_window + [(last.x(), last.y())]
+            if self.max_deviation(np.array(window), (anchor.x(), anchor.y()), (x, y)) <= STREAM_TOLERANCE:
+                # 末尾の点を新しい点で置き換えても形が変わらない
+                self.stream_window = window
+                self.points[-1] = QPointF(point)
+                self.path.setElementPositionAt(self.path.elementCount() - 1, x, y)
+                self.invalidate_geometry()
+                return
+
+        self.stream_window = []
+        self.points.append(QPointF(point))
+        self.path.lineTo(point)
+        self.invalidate_geometry()
+
+    @staticmethod
+    def max_deviation(points, start, end):
+        # points の各点から線分 start-end までの距離の最大値
+        p1 = np.array(start)
+        d = np.array(end) - p1
+        length_sq = d @ d
+        if length_sq == 0:
+            return np.hypot(*(points - p1).T).max()
+        t = np.clip((points - p1) @ d / length_sq, 0, 1)
+        return np.hypot(*(points - p1 - t[:, None] * d).T).max()
+
+    def invalidate_geometry(self):
+        self.geometry_version += 1
+        self.outline_cache.clear()
+
+    def generate_path_from_bspline(self, preview=False):
+        self.invalidate_geometry()
+        if len(self.control_point_array) < 2:
             self.path = QPainterPath()
             return
 
         self.path = QPainterPath()
-        points = [QPointF(x, y) for x, y in self.spline_control_points]
-        if len(points) >= 4:
-            b_spline = self.calculate_bspline(points)
-            self.path.moveTo(b_spline[0])
-            for point in b_spline[1:]:
-                self.path.lineTo(point)
+        if self.spline_mode == 'catmull_rom':
+            self.build_catmull_rom_path()
+            return
+        if len(self.control_point_array) >= 4:
+            points = self.fit_spline()[1]
+            if self.curve_backend == 'bezier' and not preview:
+                self.build_bezier_path(points)
+                return
         else:
-            self.path.moveTo(points[0])
-            for point in points[1:]:
-                self.path.lineTo(point)
+            points = self.control_point_array
+        coords = points.tolist()
+        self.path.moveTo(*coords[0])
+        for x, y in coords[1:]:
+            self.path.lineTo(x, y)
+
+        if self.fill_enabled:
+            self.path.closeSubpath()
+
+    @staticmethod
+    def catmull_rom_segments(points, first, last):
+        # 区間 j (P[j] -> P[j+1]) の 3 次ベジェ制御点。端点は複製して扱う
+        j = np.arange(first, last + 1)
+        p0 = points[np.maximum(j - 1, 0)]
+        p1 = points[j]
+        p2 = points[j + 1]
+        p3 = points[np.minimum(j + 2, len(points) - 1)]
+        return p1 + (p2 - p0) / 6, p2 - (p3 - p1) / 6, p2
+
+    def bezier_segments(self, samples):
+        if self.bezier_cache is None or self.bezier_cache[0] is not samples:
+            self.bezier_cache = (samples, fit_beziers(samples, self.bezier_tolerance))
+        return self.bezier_cache[1]
+
+    def build_bezier_path(self, samples):
+        segments = self.bezier_segments(samples)
+        self.path.moveTo(*segments[0][0].tolist())
+        for _, (x1, y1), (x2, y2), (x, y) in segments.tolist():
+            self.path.cubicTo(x1, y1, x2, y2, x, y)
+        if self.fill_enabled:
+            self.path.closeSubpath()
 
+    def build_catmull_rom_path(self):
+        points = self.control_point_array
+        c1, c2, end = self.catmull_rom_segments(points, 0, len(points) - 2)
+        self.path.moveTo(*points[0].tolist())
+        for (x1, y1), (x2, y2), (x, y) in zip(c1.tolist(), c2.tolist(), end.tolist()):
+            self.path.cubicTo(x1, y1, x2, y2, x, y)
         if self.fill_enabled:
             self.path.closeSubpath()
 
+    def patch_catmull_rom_path(self, index):
+        # 制御点 index の影響を受けるのは前後 2 区間だけなので、その要素だけを書き換える
+        points = self.control_point_array
+        count = len(points)
+        if count < 2 or self.path.elementCount() < 1 + 3 * (count - 1):
+            return False
+        if self.fill_enabled and index in (0, count - 1):
+            return False
+        first = max(0, index - 2)
+        last = min(count - 2, index + 1)
+        c1, c2, end = self.catmull_rom_segments(points, first, last)
+        if index == 0:
+            self.path.setElementPositionAt(0, *points[0].tolist())
+        for segment, (a, b, e) in enumerate(zip(c1.tolist(), c2.tolist(), end.tolist()), first):
+            element = 1 + 3 * segment
+            self.path.setElementPositionAt(element, *a)
+            self.path.setElementPositionAt(element + 1, *b)
+            self.path.setElementPositionAt(element + 2, *e)
+        self.invalidate_geometry()
+        return True
+
     def draw(self, painter, control_point_size=0):
         if not self.path.isEmpty():
             pen = QPen(self.pen_color, self.pen_width, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin)
@@ -58,10 +228,18 @@ class VectorPath:
             if self.fill_enabled:
                 brush = QBrush(self.fill_color)
                 painter.setBrush(brush)
-                painter.drawPath(self.path)
             else:
                 painter.setBrush(Qt.NoBrush)
+            if self.transform.isIdentity():
                 painter.drawPath(self.path)
+            elif self.transform.type() == QTransform.TxTranslate:
+                painter.save()
+                painter.setTransform(self.transform, True)
+                painter.drawPath(self.path)
+                painter.restore()
+            else:
+                # 拡大・回転をペインタに任せると線幅まで変わるので、パスの方を変換して描く
+                painter.drawPath(self.transformed_path())
 
             if self.selected:
                 self.draw_selection_rectangle(painter)
@@ -72,26 +250,20 @@ class VectorPath:
     def draw_control_points(self, painter: QPainter, control_point_size: int):
         painter.setBrush(QColor(255, 0, 0))
         painter.setPen(Qt.NoPen)
-        for cp in self.spline_control_points:
-            rect = QRectF(cp[0] - control_point_size / 2, cp[1] - control_point_size / 2,
-                          control_point_size, control_point_size)
-            painter.drawRect(rect)
+        half = control_point_size / 2
+        painter.drawRects([QRectF(x - half, y - half, control_point_size, control_point_size)
+                           for x, y in self.transformed_control_points().tolist()])
 
     def draw_selection_rectangle(self, painter: QPainter):
-        bounding_rect = self.path.boundingRect().adjusted(-10, -10, 10, 10)
+        bounding_rect = self.get_selection_rect()
 
         pen = QPen(QColor(0, 120, 215), 1, Qt.DashLine)
         painter.setPen(pen)
         painter.setBrush(Qt.NoBrush)
         painter.drawRect(bounding_rect)
 
-        handle_size = 10
-        corners = [
-            bounding_rect.topLeft(),
-            bounding_rect.topRight(),
-            bounding_rect.bottomLeft(),
-            bounding_rect.bottomRight(),
-        ]
+        handle_size = SELECTION_HANDLE_SIZE
+        corners = self.selection_handles()
 
         handle_pen = QPen(QColor(0, 120, 215), 1, Qt.SolidLine)
         handle_brush = QBrush(QColor(0, 120, 215))
@@ -103,169 +275,313 @@ class VectorPath:
             painter.drawRect(handle_rect)
 
     def get_selection_rect(self):
-        return self.path.boundingRect().adjusted(-10, -10, 10, 10)
-
-    def contains_control_point(self, pos: QPointF, control_point_size: int) -> bool:
-        for x, y in self.spline_control_points:
-            rect = QRectF(
-                x - control_point_size / 2,
-                y - control_point_size / 2,
-                control_point_size,
-                control_point_size
-            )
-            if rect.contains(pos):
-                return True
-        return False
+        return self.transform.mapRect(self.path.boundingRect()).adjusted(-10, -10, 10, 10)
 
-    def get_control_point_at(self, pos: QPointF, control_point_size: int):
-        for index, (x, y) in enumerate(self.spline_control_points):
-            rect = QRectF(
-                x - control_point_size / 2,
-                y - control_point_size / 2,
-                control_point_size,
-                control_point_size
-            )
-            if rect.contains(pos):
+    def selection_handles(self):
+        rect = self.get_selection_rect()
+        return [rect.topLeft(), rect.topRight(), rect.bottomLeft(), rect.bottomRight()]
+
+    def handle_at(self, pos: QPointF, handle_size=SELECTION_HANDLE_SIZE):
+        half = handle_size / 2
+        for index, corner in enumerate(self.selection_handles()):
+            if abs(pos.x() - corner.x()) <= half and abs(pos.y() - corner.y()) <= half:
                 return index
         return None
 
+    def bounds(self):
+        return self.transform.mapRect(self.path.controlPointRect())
+
+    def visual_rect(self, control_point_size=0):
+        # ペン幅・選択枠・ハンドル・制御点を含めた描画範囲
+        margin = max(self.pen_width / 2, 10 + 5, control_point_size / 2) + 1
+        return self.bounds().adjusted(-margin, -margin, margin, margin)
+
+    def transformed_control_points(self):
+        if self.transform.isIdentity():
+            return self.control_point_array
+        return transform_points(self.transform, self.control_point_array)
+
+    def transformed_path(self):
+        if self.transform.isIdentity():
+            return self.path
+        return self.transform.map(self.path)
+
+    def bake_transform(self):
+        # 変換を制御点・フィット結果・描画パスに反映する。B スプラインはアフィン変換で
+        # 形が保たれるので係数とサンプル点を変換するだけでよく、再フィットは不要
+        if self.transform.isIdentity():
+            return
+        transform = self.transform
+        fit = self.spline_fit
+        self.control_point_array = transform_points(transform, self.control_point_array)
+        self.transform = QTransform()
+        if self.raw_points is not None:
+            self.raw_points = transform_points(transform, self.raw_points)
+            self.derived_cache = {}
+        if fit is not None:
+            (t, c, k), samples = fit
+            beziers = self.bezier_cache[1] if self.bezier_cache and self.bezier_cache[0] is samples else None
+            coefficients = transform_points(transform, np.column_stack(c))
+            tck = (t, [coefficients[:, 0], coefficients[:, 1]], k)
+            if transform.type() == QTransform.TxTranslate:
+                samples = transform_points(transform, samples)
+            else:
+                # 拡大・回転後は曲線の長さが変わるのでサンプル数だけ選び直す
+                from scipy.interpolate import splev
+                unew = np.linspace(0, 1.0, num=self.sample_count(self.control_point_array))
+                samples = np.column_stack(splev(unew, tck))
+            self.spline_fit = (tck, samples)
+            if beziers is not None:
+                # ベジェ曲線もアフィン変換で形が保たれるので、制御点を変換するだけでよい
+                self.bezier_cache = (samples, transform_points(transform, beziers.reshape(-1, 2)).reshape(-1, 4, 2))
+        if transform.type() == QTransform.TxTranslate:
+            self.path = transform.map(self.path)
+            self.invalidate_geometry()
+        else:
+            self.generate_path_from_bspline()
+
+    def control_point_hits(self, pos: QPointF, control_point_size: int):
+        # 各制御点の矩形 (QRectF.contains と同じく辺上も含む) に pos が入るかを一括判定する
+        left_top = self.transformed_control_points() - control_point_size / 2
+        right_bottom = left_top + control_point_size
+        p = np.array((pos.x(), pos.y()))
+        return np.all((left_top <= p) & (p <= right_bottom), axis=1)
+
+    def get_control_point_at(self, pos: QPointF, control_point_size: int):
+        indices = np.flatnonzero(self.control_point_hits(pos, control_point_size))
+        if len(indices) == 0:
+            return None
+        return int(indices[0])
+
     def move_control_point(self, index: int, delta: QPointF):
-        x, y = self.spline_control_points[index]
-        self.spline_control_points[index] = (x + delta.x(), y + delta.y())
-        self.generate_path_from_bspline()
+        self.bake_transform()
+        self.forget_raw_points()
+        self.control_point_array[index] += (delta.x(), delta.y())
+        self.spline_fit = None
+        if self.spline_mode == 'catmull_rom' and self.patch_catmull_rom_path(index):
+            return
+        self.preview_geometry = self.curve_backend == 'bezier'
+        self.generate_path_from_bspline(preview=self.preview_geometry)
+
+    def commit_edit(self):
+        # ドラッグ終了時に呼ばれる。変換を焼き込み、プレビュー用の形状を作り直す
+        self.bake_transform()
+        if self.preview_geometry:
+            self.preview_geometry = False
+            self.generate_path_from_bspline()
+
+    def stroke_outline(self, width):
+        key = (width, self.geometry_version)
+        outline = self.outline_cache.get(key)
+        if outline is None:
+            stroker = QPainterPathStroker()
+            stroker.setWidth(width)
+            outline = stroker.createStroke(self.path)
+            self.outline_cache[key] = outline
+        return outline
+
+    def hit_test(self, point, width):
+        # 外接矩形で先に弾き、アウトラインは必要な時だけ作る
+        if not self.transform.isIdentity():
+            point = self.transform.inverted()[0].map(point)
+        margin = width / 2 + 1
+        if not self.path.controlPointRect().adjusted(-margin, -margin, margin, margin).contains(point):
+            return False
+        return self.stroke_outline(width).contains(point)
 
     def contains_point(self, point, threshold):
-        stroker = QPainterPathStroker()
-        stroker.setWidth(threshold)
-        stroke = stroker.createStroke(self.path)
-        return stroke.contains(point)
+        return self.hit_test(point, threshold)
 
     def contains(self, pos: QPointF, hit_threshold: float = 2.0) -> bool:
-        stroker = QPainterPathStroker()
-        stroker.setWidth(hit_threshold * 2)
-        stroked_path = stroker.createStroke(self.path)
-        return stroked_path.contains(pos)
+        return self.hit_test(pos, hit_threshold * 2)
 
     def find_insertion_index(self, click_pos: QPointF) -> int:
-        min_distance = float('inf')
-        insertion_index = None
-        for i in range(len(self.spline_control_points) - 1):
-            cp1 = self.spline_control_points[i]
-            cp2 = self.spline_control_points[i + 1]
-            p1 = QPointF(cp1[0], cp1[1])
-            p2 = QPointF(cp2[0], cp2[1])
-            distance = self.point_to_segment_distance(click_pos, p1, p2)
-            if distance < min_distance:
-                min_distance = distance
-                insertion_index = i + 1
-        return insertion_index
+        if len(self.control_point_array) < 2:
+            return None
+        distances = self.segment_distances(self.transformed_control_points(), np.array((click_pos.x(), click_pos.y())))
+        return int(np.argmin(distances)) + 1
 
     @staticmethod
-    def point_to_segment_distance(p: QPointF, p1: QPointF, p2: QPointF) -> float:
-        if p1 == p2:
-            return math.hypot(p.x() - p1.x(), p.y() - p1.y())
-        else:
-            dx = p2.x() - p1.x()
-            dy = p2.y() - p1.y()
-            t = ((p.x() - p1.x()) * dx + (p.y() - p1.y()) * dy) / (dx * dx + dy * dy)
-            t = max(0, min(1, t))
-            nearest_x = p1.x() + t * dx
-            nearest_y = p1.y() + t * dy
-            return math.hypot(p.x() - nearest_x, p.y() - nearest_y)
-
-    def calculate_bspline(self, points):
-        x = [p.x() for p in points]
-        y = [p.y() for p in points]
-        tck, u = splprep([x, y], s=0)
-        unew = np.linspace(0, 1.0, num=100)
-        out = splev(unew, tck)
-        bspline_points = [QPointF(out[0][i], out[1][i]) for i in range(len(out[0]))]
-        return bspline_points
+    def segment_distances(points, p):
+        # 連続する制御点を結ぶ各線分と点 p の距離をまとめて求める
+        p1 = points[:-1]
+        d = points[1:] - p1
+        length_sq = np.einsum('ij,ij->i', d, d)
+        t = np.einsum('ij,ij->i', p - p1, d) / np.where(length_sq > 0, length_sq, 1)
+        t = np.clip(np.where(length_sq > 0, t, 0), 0, 1)
+        nearest = p1 + d * t[:, None]
+        return np.hypot(*(p - nearest).T)
+
+    def fit_spline(self):
+        # (tck, サンプル点) を制御点が変わるまで使い回す
+        if self.spline_fit is None:
+            self.spline_fit = self.fit_points(self.control_point_array)
+        return self.spline_fit
+
+    @classmethod
+    def fit_points(cls, points):
+        # SciPy は読み込みが重いので、最初にフィットする時まで import しない
+        from scipy.interpolate import splprep, splev
+        tck, u = splprep([points[:, 0], points[:, 1]], s=0)
+        unew = np.linspace(0, 1.0, num=cls.sample_count(points))
+        return tck, np.column_stack(splev(unew, tck))
+
+    @staticmethod
+    def sample_count(points):
+        d = np.diff(points, axis=0)
+        length = np.hypot(d[:, 0], d[:, 1]).sum()
+        headings = np.arctan2(d[:, 1], d[:, 0])
+        turning = np.abs((np.diff(headings) + np.pi) % (2 * np.pi) - np.pi).sum()
+        count = int(length / SAMPLE_SPACING + turning / SAMPLE_ANGLE_STEP)
+        return max(MIN_SAMPLES, min(MAX_SAMPLES, count))
 
     def finalize(self):
-        self.spline_control_points = [(p.x(), p.y()) for p in self.points]
-        self.smooth_and_simplify()
+        self.apply_finalized(self.finalize_points(*self.finalize_args()))
+
+    def finalize_args(self):
+        # ワーカースレッドに渡す引数。VectorPath 自体には触れさせない
+        main_window = self.drawing_area.main_window
+        self.raw_points = np.array([(p.x(), p.y()) for p in self.points], dtype=float).reshape(-1, 2)
+        self.simplify_tolerance = main_window.default_simplify_tolerance
+        self.smooth_strength = main_window.default_smooth_strength
+        self.derived_cache = {}
+        return (self.raw_points, self.simplify_tolerance, self.smooth_strength) + self.fit_options()
+
+    def fit_options(self):
+        fit = self.spline_mode == 'interpolate'
+        bezier_tolerance = self.bezier_tolerance if fit and self.curve_backend == 'bezier' else None
+        return fit, bezier_tolerance
+
+    @classmethod
+    def finalize_points(cls, points, simplify_tolerance, smooth_strength, fit, bezier_tolerance=None):
+        points = cls.simplified(points, simplify_tolerance)
+        points = cls.smoothed(points, smooth_strength)
+        spline_fit = cls.fit_points(points) if fit and len(points) >= 4 else None
+        beziers = None
+        if spline_fit is not None and bezier_tolerance is not None:
+            beziers = fit_beziers(spline_fit[1], bezier_tolerance)
+        return points, spline_fit, beziers
+
+    def apply_finalized(self, result):
+        if self.raw_points is not None:
+            self.remember_derived((self.simplify_tolerance, self.smooth_strength), result)
+        self.pending = False
+        self.apply_derived(result)
+
+    def apply_derived(self, result):
+        points, spline_fit, beziers = result
+        # キャッシュの配列は他のコピーとも共有するので、編集用には複製を持つ
+        self.control_point_array = points.copy()
+        self.spline_fit = spline_fit
+        if beziers is not None:
+            self.bezier_cache = (spline_fit[1], beziers)
         self.generate_path_from_bspline()
 
-    def smooth_and_simplify(self):
-        simplify_tolerance = self.drawing_area.main_window.default_simplify_tolerance
-        smooth_strength = self.drawing_area.main_window.default_smooth_strength
-
-        self.simplify_path(simplify_tolerance)
-        self.smooth_path(smooth_strength)
-
-    def simplify_path(self, tolerance):
-        if tolerance <= 0:
-            return
-
-        if len(self.spline_control_points) < 2:
-            return
+    def remember_derived(self, key, result):
+        self.derived_cache.pop(key, None)
+        self.derived_cache[key] = result
+        while len(self.derived_cache) > DERIVED_CACHE_SIZE:
+            del self.derived_cache[next(iter(self.derived_cache))]
+
+    def processing_source(self):
+        return self.raw_points if self.raw_points is not None else self.control_point_array
+
+    def needs_processing(self, tolerance, strength):
+        key = (tolerance, strength)
+        return key != (self.simplify_tolerance, self.smooth_strength) and key not in self.derived_cache
+
+    def set_processing(self, tolerance, strength, simplified=None):
+        # 元の点から (tolerance, strength) の形状を作り直す。結果は覚えておき、
+        # スライダーを戻した時は計算し直さない。simplified は間引き済みの点（まとめて計算した場合）
+        if self.raw_points is None:
+            self.raw_points = self.control_point_array.copy()
+            self.simplify_tolerance = 0
+            self.smooth_strength = 0
+            self.derived_cache = {(0, 0): (self.raw_points, self.spline_fit, None)}
+        key = (tolerance, strength)
+        if key == (self.simplify_tolerance, self.smooth_strength):
+            return False
+        result = self.derived_cache.get(key)
+        if result is None:
+            if simplified is None:
+                simplified = self.simplified(self.raw_points, tolerance)
+            result = self.finalize_points(simplified, 0, strength, *self.fit_options())
+        self.remember_derived(key, result)
+        self.simplify_tolerance, self.smooth_strength = key
+        self.apply_derived(result)
+        return True
+
+    def forget_raw_points(self):
+        # 制御点を直接編集したら、その形を新しい元データとする
+        if self.raw_points is not None:
+            self.raw_points = None
+            self.simplify_tolerance = 0
+            self.smooth_strength = 0
+            self.derived_cache = {}
 
-        coords = [(x, y) for x, y in self.spline_control_points]
-        line = LineString(coords)
-        simplified_line = line.simplify(tolerance, preserve_topology=False)
-        self.spline_control_points = list(simplified_line.coords)
+    @staticmethod
+    def simplified(points, tolerance):
+        return douglas_peucker(points, tolerance)
 
-    def smooth_path(self, strength):
+    @staticmethod
+    def smoothed(points, strength):
         if strength <= 0:
-            return
+            return points
 
-        if len(self.spline_control_points) < 3:
-            return
+        if len(points) < 3:
+            return points
 
-        coords = np.array(self.spline_control_points)
-        smoothed_coords = coords.copy()
+        smoothed_coords = points.copy()
 
         for _ in range(strength):
             smoothed_coords[1:-1] = (smoothed_coords[:-2] + smoothed_coords[1:-1] + smoothed_coords[2:]) / 3
 
-        self.spline_control_points = [tuple(coord) for coord in smoothed_coords]
+        return smoothed_coords
+
+    def nbytes(self):
+        # copy() で複製される分（形状と制御点）。生サンプルや派生形状のキャッシュはコピー間で共有される
+        elements = self.path.elementCount() + self.qt_path.elementCount()
+        return PATH_OVERHEAD_BYTES + elements * PATH_ELEMENT_BYTES + self.control_point_array.nbytes
 
     def copy(self):
         new_path = VectorPath(self.drawing_area)
         new_path.control_points = list(self.control_points)
-        new_path.spline_control_points = list(self.spline_control_points)
+        new_path.control_point_array = self.control_point_array.copy()
+        new_path.spline_fit = self.spline_fit
         new_path.pen_color = QColor(self.pen_color)
         new_path.pen_width = self.pen_width
         new_path.fill_color = QColor(self.fill_color)
         new_path.fill_enabled = self.fill_enabled
         new_path.is_closed = self.is_closed
+        new_path.spline_mode = self.spline_mode
+        new_path.curve_backend = self.curve_backend
+        new_path.bezier_tolerance = self.bezier_tolerance
+        new_path.bezier_cache = self.bezier_cache
+        new_path.preview_geometry = self.preview_geometry
+        new_path.transform = QTransform(self.transform)
+        new_path.raw_points = self.raw_points
+        new_path.simplify_tolerance = self.simplify_tolerance
+        new_path.smooth_strength = self.smooth_strength
+        new_path.derived_cache = dict(self.derived_cache)
         new_path.path = QPainterPath(self.path)
         new_path.qt_path = QPainterPath(self.qt_path)
+        new_path.geometry_version = self.geometry_version
+        new_path.outline_cache = dict(self.outline_cache)
         return new_path
 
     def move_by(self, delta: QPointF):
-        self.spline_control_points = [
-            (x + delta.x(), y + delta.y()) for x, y in self.spline_control_points
-        ]
-        self.generate_path_from_bspline()
-
-    def path_to_svg_d(self):
-        elements = []
-        i = 0
-        while i < self.path.elementCount():
-            elem = self.path.elementAt(i)
-            if elem.type == QPainterPath.ElementType.MoveToElement:
-                elements.append(f"M {elem.x} {elem.y}")
-            elif elem.type == QPainterPath.ElementType.LineToElement:
-                elements.append(f"L {elem.x} {elem.y}")
-            elif elem.type == QPainterPath.ElementType.CurveToElement:
-                cp1 = elem
-                i += 1
-                cp2 = self.path.elementAt(i)
-                i += 1
-                end = self.path.elementAt(i)
-                elements.append(f"C {cp1.x} {cp1.y} {cp2.x} {cp2.y} {end.x} {end.y}")
-            elif elem.type == QPainterPath.ElementType.CurveToDataElement:
-                pass
-            i += 1
-        return ' '.join(elements)
+        # 移動中は変換を積むだけにして、制御点やパスには bake_transform で確定時に反映する
+        self.transform = self.transform * QTransform.fromTranslate(delta.x(), delta.y())
 
     def insert_control_point(self, index: int, pos: QPointF):
-        self.spline_control_points.insert(index, (pos.x(), pos.y()))
+        self.bake_transform()
+        self.forget_raw_points()
+        self.control_point_array = np.insert(self.control_point_array, index, (pos.x(), pos.y()), axis=0)
         self.generate_path_from_bspline()
 
     def delete_control_point(self, index: int):
-        if len(self.spline_control_points) > 2:
-            del self.spline_control_points[index]
+        self.bake_transform()
+        self.forget_raw_points()
+        if len(self.control_point_array) > 2:
+            self.control_point_array = np.delete(self.control_point_array, index, axis=0)
             self.generate_path_from_bspline()